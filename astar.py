@@ -1,10 +1,23 @@
 """An A* implementation."""
 
 from abc import ABCMeta, abstractmethod
+from array import array
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import pickle
 import time
+import zlib
 from typing import Iterator, Tuple
 
-from priqueue import PriorityQueue
+try:
+    import resource
+except ImportError:     # Not on Windows.
+    resource = None
+
+from priqueue import BucketQueue, PriorityQueue
 
 
 class State(metaclass=ABCMeta):
@@ -22,6 +35,31 @@ class State(metaclass=ABCMeta):
     def guess_completion_cost(self) -> float:
         """Guess at the cost to reach the goal. Must not overestimate."""
 
+    def key(self):
+        """A small hashable value identifying this state, like an int or bytes.
+
+        Equal states must have equal keys.  AStar uses keys for its tables, so
+        a compact key that is quick to hash makes large searches faster and
+        smaller.  By default, the state is its own key.
+
+        """
+        return self
+
+    def previous_states(self, cost) -> Iterator[Tuple['State', float]]:
+        """Produce states one move before this one: (prev_state, new_cost), ...
+
+        Only needed for searching backward from goal states.
+        """
+        raise NotImplementedError
+
+    def guess_cost_from(self, start) -> float:
+        """Guess at the cost to reach this state from `start`. Must not overestimate.
+
+        Only used for searching backward from goal states.  The default of 0
+        makes the backward search Dijkstra's.
+        """
+        return 0
+
     def summary(self) -> str:
         """A short summary of the state, for progress logging."""
         return ""
@@ -40,47 +78,1033 @@ class OnceEvery:
         return ret
 
 
+class SearchStats:
+    """Counters kept by an AStar search, reported every so often.
+
+    `report` is called with a dict of the counters at most once every
+    `seconds`.  The clock is only checked every `check_every` expansions.
+
+    The counters are:
+
+        expansions: states whose next states were generated.
+        generations: next states generated.
+        duplicates: next states already visited, or no cheaper than before.
+        reopenings: next states already a candidate, now with a cheaper cost.
+
+    Reports also include the cost of the state being expanded, the size of
+    the candidate queue's heap and how many live items it has,
+    expansions/sec since the last report, peak memory in Kb, and the state's
+    summary().
+
+    """
+    def __init__(self, report=None, seconds=5, check_every=1000):
+        self.report = report
+        self.seconds = seconds
+        self.check_every = check_every
+        self.expansions = 0
+        self.generations = 0
+        self.duplicates = 0
+        self.reopenings = 0
+        self.last_time = time.monotonic()
+        self.last_expansions = 0
+
+    def tick(self, astar, state, cost, force=False):
+        """Report the counters if it's time."""
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        if not force and elapsed < self.seconds:
+            return
+        candidates = astar.candidates
+        record = {
+            "cost": cost,
+            "expansions": self.expansions,
+            "generations": self.generations,
+            "duplicates": self.duplicates,
+            "reopenings": self.reopenings,
+            "visited": astar.num_visited,
+            "heap_size": len(getattr(candidates, "q", candidates)),
+            "live": len(candidates),
+            "expansions_per_sec": (self.expansions - self.last_expansions) / elapsed if elapsed else 0,
+            "peak_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            "summary": state.summary() if state is not None else "",
+        }
+        self.last_time = now
+        self.last_expansions = self.expansions
+        if self.report is not None:
+            self.report(record)
+
+
+class JsonLines:
+    """A SearchStats report function writing JSON lines to a file."""
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, record):
+        self.f.write(json.dumps(record) + "\n")
+        self.f.flush()
+
+
+def print_report(record):
+    """A SearchStats report function for the log=True progress lines."""
+    print(
+        f"cost {record['cost']}; {record['visited']} visited, {record['live']} candidates, "
+        f"{record['expansions_per_sec']:.0f}/sec, {record['summary']}"
+    )
+
+
 class AStar:
+    # How often to check if it's time to write a checkpoint, in expansions.
+    CHECKPOINT_EVERY = 1000
+
+    def __init__(
+        self, max_visited=None, queue_class=PriorityQueue, integral=False, stats=None,
+        checkpoint=None, checkpoint_seconds=60,
+    ):
+        if integral:
+            # All costs and guesses are integers: buckets beat a heap.
+            queue_class = BucketQueue
+        self.queue_class = queue_class
+        # Every state we've seen gets an integer id: ids maps state.key() to
+        # the id, and states[id] is the state.  The rest of our tables are
+        # indexed by id: the candidates are ids, costs[id] is the best cost to
+        # reach the state, visited[id] is 1 once it has been expanded, and
+        # parents[id] is the id of the state we reached it from, or -1.
+        self.ids = {}
+        self.states = []
+        self.candidates = queue_class()
+        self.costs = []
+        self.visited = bytearray()
+        self.num_visited = 0
+        self.parents = array('q')
+        # If we visit more than this many states, switch to IDA*.
+        self.max_visited = max_visited
+        # A SearchStats to count with, or None.
+        self.stats = stats
+        # A directory to save our progress in, or None.
+        self.checkpoint = checkpoint
+        self.checkpoint_seconds = checkpoint_seconds
+        # Ids of states visited since the last checkpoint.
+        self.newly_visited = []
+
+    def intern(self, state):
+        """The integer id of `state`, giving it one if needed."""
+        key = state.key()
+        state_id = self.ids.get(key)
+        if state_id is None:
+            state_id = self.ids[key] = len(self.states)
+            self.states.append(state)
+            self.costs.append(float('inf'))
+            self.visited.append(0)
+            self.parents.append(-1)
+        return state_id
+
+    def add_candidate(self, state_id, cost, parent_id=-1):
+        state = self.states[state_id]
+        self.costs[state_id] = cost
+        self.parents[state_id] = parent_id
+        priority = cost + state.guess_completion_cost()
+        if priority == float('inf'):
+            # The guess says no goal can be reached from here.
+            return
+        self.candidates.add(state_id, priority)
+
+    def path_to(self, state_id):
+        """The list of states from the start to the state with id `state_id`."""
+        path = []
+        while state_id >= 0:
+            path.append(self.states[state_id])
+            state_id = self.parents[state_id]
+        path.reverse()
+        return path
+
+    # A checkpoint is two files in the checkpoint directory.  "closed" is a
+    # series of pickled lists of (visited state, parent's key), appended to at
+    # each checkpoint.  "open" is rewritten at each checkpoint: the pickle of
+    # the start state, then a pickled dict of the candidates with their costs
+    # and parents' keys, and how much of "closed" goes with them.  Only the
+    # states visited since the last checkpoint and the current candidates are
+    # written, so checkpoints don't get slower as the visited set grows.  The
+    # start state's pickle includes the objects it shares, since keys only
+    # tell states apart within one search.  The files are removed when the
+    # search finishes.
+
+    def parent_key(self, state_id):
+        parent_id = self.parents[state_id]
+        return self.states[parent_id].key() if parent_id >= 0 else None
+
+    def save_checkpoint(self, start_pickle, shared):
+        closed_path = os.path.join(self.checkpoint, "closed")
+        open_path = os.path.join(self.checkpoint, "open")
+        with open(closed_path, "ab") as fclosed:
+            if self.newly_visited:
+                closed = [(self.states[i], self.parent_key(i)) for i in self.newly_visited]
+                fclosed.write(dump_states(closed, shared))
+            closed_size = fclosed.tell()
+        snapshot = {
+            "closed_size": closed_size,
+            "open": [(self.states[i], self.costs[i], self.parent_key(i)) for i in self.candidates],
+        }
+        with open(open_path + ".tmp", "wb") as fopen:
+            pickle.dump(start_pickle, fopen)
+            fopen.write(dump_states(snapshot, shared))
+        os.replace(open_path + ".tmp", open_path)
+        self.newly_visited = []
+
+    def load_checkpoint(self, start_pickle, shared):
+        """Load the checkpoint, if there is one.  Returns True if there was.
+
+        A checkpoint from a search with a different start state is left alone,
+        and raises ValueError.
+
+        """
+        closed_path = os.path.join(self.checkpoint, "closed")
+        open_path = os.path.join(self.checkpoint, "open")
+        if not os.path.exists(open_path):
+            # Anything in "closed" is from a checkpoint that never finished.
+            with open(closed_path, "wb"):
+                pass
+            return False
+        with open(open_path, "rb") as fopen:
+            # Check the start before loading states that might not fit `shared`.
+            if pickle.load(fopen) != start_pickle:
+                raise ValueError(f"The checkpoint in {self.checkpoint} is for a different start state")
+            snapshot = load_states(fopen.read(), shared)
+        with open(closed_path, "r+b") as fclosed:
+            # Drop anything appended by a checkpoint that never finished.
+            fclosed.truncate(snapshot["closed_size"])
+            while fclosed.tell() < snapshot["closed_size"]:
+                for state, parent_key in SharedUnpickler(fclosed, shared).load():
+                    state_id = self.intern(state)
+                    self.visited[state_id] = 1
+                    self.num_visited += 1
+                    self.parents[state_id] = self.ids[parent_key] if parent_key is not None else -1
+        for state, cost, parent_key in snapshot["open"]:
+            parent_id = self.ids[parent_key] if parent_key is not None else -1
+            self.add_candidate(self.intern(state), cost, parent_id)
+        return True
+
+    def remove_checkpoint(self):
+        for name in ["open", "closed"]:
+            try:
+                os.remove(os.path.join(self.checkpoint, name))
+            except FileNotFoundError:
+                pass
+
+    def search(self, start_state, log=False, path=False):
+        """Search from `start_state`.
+
+        Returns the cost to reach the goal, or with `path`, a tuple: the cost,
+        and the list of states from `start_state` to the goal.
+
+        """
+        return run_to_end(self.run(start_state, log, path))
+
+    def run(self, start_state, log=False, path=False, slice_size=None):
+        """A generator performing the search, yielding every `slice_size` expansions.
+
+        The generator's return value is the result of `search`.
+
+        """
+        if log and self.stats is None:
+            self.stats = SearchStats(print_report)
+        stats = self.stats
+        checkpoint_time = None
+        if self.checkpoint is not None:
+            shared = shared_objects(start_state)
+            start_pickle = pickle.dumps(start_state, pickle.HIGHEST_PROTOCOL)
+            os.makedirs(self.checkpoint, exist_ok=True)
+            checkpoint_time = time.monotonic() + self.checkpoint_seconds
+            if log:
+                print(f"Checkpointing to {self.checkpoint}")
+        if checkpoint_time is None or not self.load_checkpoint(start_pickle, shared):
+            self.add_candidate(self.intern(start_state), 0)
+        # Expanded states can be forgotten, unless we need them for a path or
+        # a checkpoint.
+        forget_states = not path and checkpoint_time is None
+
+        states, costs, visited = self.states, self.costs, self.visited
+        intern, add_candidate = self.intern, self.add_candidate
+        best = None
+        cost = 0
+        try:
+            while True:
+                try:
+                    best_id = self.candidates.pop()
+                except IndexError:
+                    if checkpoint_time is not None:
+                        self.remove_checkpoint()
+                    raise Exception("No solution") from None
+                best = states[best_id]
+                cost = costs[best_id]
+                if best.is_goal():
+                    if checkpoint_time is not None:
+                        self.remove_checkpoint()
+                    if path:
+                        return cost, self.path_to(best_id)
+                    return cost
+                if self.max_visited is not None and self.num_visited >= self.max_visited:
+                    # Out of room: start over with IDA*.  States are popped in
+                    # order of total cost, so this one's is a lower bound.
+                    bound = cost + best.guess_completion_cost()
+                    if log:
+                        print(f"{self.num_visited} visited, switching to IDA* with bound {bound}")
+                    self.ids.clear()
+                    states.clear()
+                    self.candidates = self.queue_class()
+                    costs.clear()
+                    visited.clear()
+                    self.parents = array('q')
+                    result = yield from IDAStar().run(start_state, log, bound, path, slice_size)
+                    if checkpoint_time is not None:
+                        self.remove_checkpoint()
+                    return result
+                if checkpoint_time is not None:
+                    if len(self.newly_visited) % self.CHECKPOINT_EVERY == 0:
+                        if time.monotonic() >= checkpoint_time:
+                            # Save `best` as a candidate: it hasn't been expanded yet.
+                            self.candidates.add(best_id, cost + best.guess_completion_cost())
+                            self.save_checkpoint(start_pickle, shared)
+                            self.candidates.remove(best_id)
+                            checkpoint_time = time.monotonic() + self.checkpoint_seconds
+                    self.newly_visited.append(best_id)
+                visited[best_id] = 1
+                self.num_visited += 1
+                if slice_size and self.num_visited % slice_size == 0:
+                    yield
+                if forget_states:
+                    states[best_id] = None
+                if stats is None:
+                    for nstate, ncost in best.next_states(cost):
+                        nstate_id = intern(nstate)
+                        if visited[nstate_id]:
+                            continue
+                        if ncost < costs[nstate_id]:
+                            add_candidate(nstate_id, ncost, best_id)
+                else:
+                    stats.expansions += 1
+                    if stats.expansions % stats.check_every == 0:
+                        stats.tick(self, best, cost)
+                    for nstate, ncost in best.next_states(cost):
+                        stats.generations += 1
+                        nstate_id = intern(nstate)
+                        if visited[nstate_id]:
+                            stats.duplicates += 1
+                            continue
+                        old_cost = costs[nstate_id]
+                        if ncost < old_cost:
+                            if old_cost != float('inf'):
+                                stats.reopenings += 1
+                            add_candidate(nstate_id, ncost, best_id)
+                        else:
+                            stats.duplicates += 1
+        finally:
+            if stats is not None:
+                stats.tick(self, best, cost, force=True)
+            if log:
+                print(f"{self.num_visited} visited, {len(self.candidates)} candidates remaining")
+
+
+def run_to_end(steps):
+    """Run a generator to its end, returning its return value."""
+    try:
+        while True:
+            next(steps)
+    except StopIteration as stop:
+        return stop.value
+
+
+class SearchCancelled(Exception):
+    """A SearchStepper's search was cancelled."""
+
+
+class SearchStepper:
+    """An AStar search that runs a slice at a time.
+
+    Each call to `step` expands up to `expansions` states, and returns True
+    once the search is done, with the answer in `result`.  `cancel` abandons
+    the search.  If `seconds` pass before the search is done, `step` raises
+    TimeoutError.  Other keyword arguments are passed to AStar.
+
+    """
+    def __init__(self, start_state, expansions=1000, seconds=None, path=False, **kwargs):
+        self.astar = AStar(**kwargs)
+        self.steps = self.astar.run(start_state, path=path, slice_size=expansions)
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        self.done = False
+        self.cancelled = False
+        self.result = None
+
+    def step(self):
+        if self.done:
+            return True
+        if self.cancelled:
+            raise SearchCancelled("The search was cancelled")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel()
+            raise TimeoutError("The search ran out of time")
+        try:
+            next(self.steps)
+        except StopIteration as stop:
+            self.done = True
+            self.result = stop.value
+        return self.done
+
+    def cancel(self):
+        self.cancelled = True
+        self.steps.close()
+
+    async def run_async(self):
+        """Run the search, letting other asyncio tasks run between slices."""
+        try:
+            while not self.step():
+                await asyncio.sleep(0)
+        finally:
+            if not self.done:
+                self.cancel()
+        return self.result
+
+
+class IDAStar:
+    """Iterative-deepening A*: depth-first searches with a growing cost bound.
+
+    Memory use is proportional to the depth of the search, at the cost of
+    re-expanding states on each iteration.  Cycles are avoided only along the
+    current path.
+
+    """
     def __init__(self):
+        self.expanded = 0
+
+    def bounded_search(self, start_state, bound, slice_size=None):
+        """Depth-first search, pruning states whose total cost exceeds `bound`.
+
+        A generator, yielding every `slice_size` expansions.  Returns (cost,
+        next_bound, path): the cost of the goal if one was found, the smallest
+        total cost that was pruned, and the states from `start_state` to the
+        goal.
+
+        """
+        inf = float('inf')
+        next_bound = inf
+        on_path = {start_state}
+        stack = [(start_state, start_state.next_states(0))]
+        while stack:
+            state, nexts = stack[-1]
+            for nstate, ncost in nexts:
+                if nstate in on_path:
+                    continue
+                total_cost = ncost + nstate.guess_completion_cost()
+                if total_cost > bound:
+                    next_bound = min(next_bound, total_cost)
+                    continue
+                if nstate.is_goal():
+                    return ncost, next_bound, [s for s, _ in stack] + [nstate]
+                self.expanded += 1
+                if slice_size and self.expanded % slice_size == 0:
+                    yield
+                on_path.add(nstate)
+                stack.append((nstate, nstate.next_states(ncost)))
+                break
+            else:
+                stack.pop()
+                on_path.remove(state)
+        return None, next_bound, None
+
+    def search(self, start_state, log=False, bound=None, path=False):
+        return run_to_end(self.run(start_state, log, bound, path))
+
+    def run(self, start_state, log=False, bound=None, path=False, slice_size=None):
+        """A generator performing the search, yielding every `slice_size` expansions.
+
+        The generator's return value is the result of `search`.
+
+        """
+        if start_state.is_goal():
+            return (0, [start_state]) if path else 0
+        if bound is None:
+            bound = start_state.guess_completion_cost()
+        while True:
+            if log:
+                print(f"IDA* bound {bound}, {self.expanded} expanded so far")
+            cost, bound, states = yield from self.bounded_search(start_state, bound, slice_size)
+            if cost is not None:
+                return (cost, states) if path else cost
+            if bound == float('inf'):
+                raise Exception("No solution")
+
+
+class AnytimeAStar:
+    """Weighted A* that keeps improving its answer until a budget runs out.
+
+    Candidates are ordered by cost + weight * guess.  When a goal is found,
+    the weight is lowered by `weight_step` (but not below 1), the candidates
+    are re-ordered, and the search continues, pruning anything that can't
+    beat the best goal so far.  Cheaper paths re-open visited states, so the
+    lowest cost + guess among the candidates is a lower bound on the best
+    possible cost.
+
+    """
+    def __init__(self, weight=2.5, weight_step=0.5, seconds=None, max_expansions=None):
+        self.weight = weight
+        self.weight_step = weight_step
+        self.seconds = seconds
+        self.max_expansions = max_expansions
         self.candidates = PriorityQueue()
         self.costs = {}
-        self.visited = set()
-        self.came_from = {}
+        self.expansions = 0
 
-    def add_candidate(self, state, cost):
-        total_cost = cost + state.guess_completion_cost()
-        self.costs[state] = cost
-        self.candidates.add(state, total_cost)
+    def search(self, start_state, log=False):
+        """Returns (cost, bound): the best cost found, and a proven bound on
+        how many times the optimal cost it could be.  A bound of 1 means the
+        cost is optimal.
+
+        """
+        inf = float('inf')
+        deadline = time.monotonic() + self.seconds if self.seconds is not None else inf
+        max_expansions = self.max_expansions if self.max_expansions is not None else inf
+        weight = self.weight
+        best_cost = inf
+        self.costs[start_state] = 0
+        self.candidates.add(start_state, weight * start_state.guess_completion_cost())
+
+        while self.candidates:
+            if self.expansions >= max_expansions:
+                break
+            if self.expansions % 1000 == 0 and time.monotonic() >= deadline:
+                break
+            state = self.candidates.pop()
+            cost = self.costs[state]
+            if cost + state.guess_completion_cost() >= best_cost:
+                continue
+            if state.is_goal():
+                best_cost = cost
+                if log:
+                    print(f"Found cost {best_cost} with weight {weight}, {self.expansions} expanded")
+                if weight > 1:
+                    weight = max(1, weight - self.weight_step)
+                    for state in list(self.candidates):
+                        self.candidates.add(state, self.costs[state] + weight * state.guess_completion_cost())
+                continue
+            self.expansions += 1
+            for nstate, ncost in state.next_states(cost):
+                guess = nstate.guess_completion_cost()
+                if ncost + guess >= best_cost:
+                    continue
+                if ncost < self.costs.get(nstate, inf):
+                    self.costs[nstate] = ncost
+                    self.candidates.add(nstate, ncost + weight * guess)
+
+        if best_cost == inf:
+            if self.candidates:
+                raise Exception("No solution within budget")
+            raise Exception("No solution")
+        lower_bound = min(
+            (self.costs[state] + state.guess_completion_cost() for state in self.candidates),
+            default=best_cost,
+        )
+        lower_bound = min(lower_bound, best_cost)
+        if best_cost == lower_bound:
+            return best_cost, 1
+        return best_cost, best_cost / lower_bound if lower_bound else inf
+
+
+class LifelongAStar:
+    """Lifelong Planning A* (LPA*): A* that can be repeated after moves change.
+
+    Keeps the best known cost to each state (g), and a one-step lookahead
+    cost computed from its predecessors (rhs).  After some states' incoming
+    moves change, call `changed` with them, and `search` again: only the
+    states whose costs are affected are re-examined.
+
+    States must implement `previous_states`, matching `next_states`, and the
+    guesses must be consistent: no move lowers the guess by more than the
+    move's cost.  All of the goal states lead to one virtual goal.
+
+    """
+    GOAL = object()
+
+    def __init__(self, start_state):
+        self.start = start_state
+        self.g = {}
+        self.rhs = {start_state: 0}
+        self.goals = set()
+        self.candidates = PriorityQueue()
+        self.candidates.add(start_state, self.calculate_key(start_state))
+        self.expansions = 0
+
+    def calculate_key(self, state):
+        inf = float('inf')
+        cost = min(self.g.get(state, inf), self.rhs.get(state, inf))
+        if state is self.GOAL:
+            # The virtual goal sorts after goal states with the same cost.
+            return (cost, cost, 1)
+        return (cost + state.guess_completion_cost(), cost, 0)
+
+    def successors(self, state):
+        if state is self.GOAL:
+            return
+        yield from state.next_states(0)
+        if state.is_goal():
+            self.goals.add(state)
+            yield self.GOAL, 0
+
+    def predecessors(self, state):
+        if state is self.GOAL:
+            return ((goal, 0) for goal in self.goals)
+        return state.previous_states(0)
+
+    def is_start(self, state):
+        return state is not self.GOAL and state == self.start
+
+    def recompute_rhs(self, state):
+        inf = float('inf')
+        if not self.is_start(state):
+            self.rhs[state] = min(
+                (self.g.get(prev, inf) + move_cost for prev, move_cost in self.predecessors(state)),
+                default=inf,
+            )
+
+    def requeue(self, state):
+        """Put `state` in the candidates if it's inconsistent, or take it out."""
+        inf = float('inf')
+        if state in self.candidates:
+            self.candidates.remove(state)
+        if self.g.get(state, inf) != self.rhs.get(state, inf):
+            self.candidates.add(state, self.calculate_key(state))
+
+    def changed(self, states):
+        """The moves into `states` may have changed."""
+        for state in states:
+            self.recompute_rhs(state)
+            self.requeue(state)
+
+    def search(self, log=False):
+        """Returns the cost to reach the goal, re-using earlier work."""
+        inf = float('inf')
+        goal = self.GOAL
+        expansions = self.expansions
+        while self.candidates:
+            if (self.candidates.min_priority() >= self.calculate_key(goal) and
+                    self.rhs.get(goal, inf) == self.g.get(goal, inf)):
+                break
+            state = self.candidates.pop()
+            self.expansions += 1
+            old_cost = self.g.get(state, inf)
+            if old_cost > self.rhs[state]:
+                # Overconsistent: we've found a cheaper way here.
+                cost = self.g[state] = self.rhs[state]
+                for nstate, move_cost in self.successors(state):
+                    if cost + move_cost < self.rhs.get(nstate, inf) and not self.is_start(nstate):
+                        self.rhs[nstate] = cost + move_cost
+                        self.requeue(nstate)
+            else:
+                # Underconsistent: the way here got more expensive.  Anything
+                # that relied on it has to look again.
+                self.g[state] = inf
+                self.recompute_rhs(state)
+                self.requeue(state)
+                for nstate, move_cost in self.successors(state):
+                    if self.rhs.get(nstate, inf) == old_cost + move_cost:
+                        self.recompute_rhs(nstate)
+                        self.requeue(nstate)
+        if log:
+            print(f"{self.expansions - expansions} expansions, {len(self.g)} states known")
+        cost = self.g.get(goal, inf)
+        if cost == inf:
+            raise Exception("No solution")
+        return cost
+
+
+class PatternDatabase:
+    """Exact costs to reach the goal in an abstraction of a state space.
+
+    An abstraction maps each state to a simpler one, ignoring some goals or
+    pieces, so that each move in the real space is a move or no move in the
+    abstract space.  Then the cost in the abstract space is a lower bound on
+    the real cost, and a good guess_completion_cost.
+
+    The costs are in an array indexed by `rank(abstract_state)`, an int in
+    range(size).
+
+    """
+    UNKNOWN = 0xFFFF
+
+    def __init__(self, costs):
+        self.costs = costs
+
+    @classmethod
+    def build(cls, goal_states, rank, size):
+        """Search backward from all of the abstract `goal_states`.
+
+        The abstract states must implement `previous_states`.
+
+        """
+        inf = float('inf')
+        costs = array('H', [cls.UNKNOWN]) * size
+        candidates = PriorityQueue()
+        pending = {}
+        for goal_state in goal_states:
+            pending[goal_state] = 0
+            candidates.add(goal_state, 0)
+        while candidates:
+            state = candidates.pop()
+            cost = pending.pop(state)
+            if cost >= cls.UNKNOWN:
+                raise ValueError(f"Cost {cost} is too large for a PatternDatabase")
+            costs[rank(state)] = cost
+            for prev, prev_cost in state.previous_states(cost):
+                if costs[rank(prev)] != cls.UNKNOWN:
+                    continue
+                if prev_cost < pending.get(prev, inf):
+                    pending[prev] = prev_cost
+                    candidates.add(prev, prev_cost)
+        return cls(costs)
+
+    def __getitem__(self, rank):
+        cost = self.costs[rank]
+        return float('inf') if cost == self.UNKNOWN else cost
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            self.costs.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        costs = array('H')
+        with open(path, "rb") as f:
+            costs.frombytes(f.read())
+        return cls(costs)
+
+
+class BidirectionalAStar:
+    """Search forward from the start and backward from the goals at once.
+
+    Both searches are A*: forward with guess_completion_cost, backward with
+    guess_cost_from the start state.  We're done when the best path found
+    through a state seen from both sides is no more than the lowest total
+    cost on either frontier, which is a lower bound on any path not yet
+    found.  So each step expands the frontier whose lowest total cost is
+    higher, or the smaller frontier if they are the same.
+
+    That bound is only right if the guesses are consistent: each is zero at
+    its own end, and never more than a move's cost plus the guess on the
+    other side of the move.
+
+    """
+    def __init__(self):
+        self.forward = PriorityQueue()
+        self.backward = PriorityQueue()
+        self.forward_costs = {}
+        self.backward_costs = {}
+        self.forward_visited = set()
+        self.backward_visited = set()
+        self.best = float('inf')
+        self.start_state = None
+
+    def expand_forward(self):
+        best = self.forward.pop()
+        self.forward_visited.add(best)
+        cost = self.forward_costs[best]
+        for nstate, ncost in best.next_states(cost):
+            self.consider(nstate, ncost, nstate.guess_completion_cost(),
+                self.forward, self.forward_costs, self.forward_visited, self.backward_costs)
+
+    def expand_backward(self):
+        best = self.backward.pop()
+        self.backward_visited.add(best)
+        cost = self.backward_costs[best]
+        for nstate, ncost in best.previous_states(cost):
+            self.consider(nstate, ncost, nstate.guess_cost_from(self.start_state),
+                self.backward, self.backward_costs, self.backward_visited, self.forward_costs)
+
+    def consider(self, state, cost, guess, candidates, costs, visited, other_costs):
+        if state in visited:
+            return
+        if cost < costs.get(state, float('inf')):
+            costs[state] = cost
+            candidates.add(state, cost + guess)
+            other_cost = other_costs.get(state)
+            if other_cost is not None:
+                self.best = min(self.best, cost + other_cost)
+
+    def search(self, start_state, goal_states, log=False):
+        should_log = OnceEvery(seconds=5)
+        self.start_state = start_state
+        self.forward_costs[start_state] = 0
+        self.forward.add(start_state, start_state.guess_completion_cost())
+        for goal_state in goal_states:
+            self.backward_costs[goal_state] = 0
+            self.backward.add(goal_state, goal_state.guess_cost_from(start_state))
+        if start_state in self.backward_costs:
+            return 0
+
+        try:
+            while self.forward and self.backward:
+                forward_bound = self.forward.min_priority()
+                backward_bound = self.backward.min_priority()
+                bound = max(forward_bound, backward_bound)
+                if self.best <= bound:
+                    break
+                if log and should_log.now():
+                    print(f"best {self.best}, bound {bound}; {len(self.forward)} forward, {len(self.backward)} backward candidates")
+                if forward_bound == backward_bound:
+                    forward = len(self.forward) <= len(self.backward)
+                else:
+                    forward = forward_bound > backward_bound
+                if forward:
+                    self.expand_forward()
+                else:
+                    self.expand_backward()
+        finally:
+            if log:
+                print(f"{len(self.forward_visited)} + {len(self.backward_visited)} visited")
+
+        if self.best == float('inf'):
+            raise Exception("No solution")
+        return self.best
+
+
+def shared_objects(state):
+    """The objects `state` refers to that aren't plain values.
+
+    These are things like the grid being explored, which every state in a
+    search shares, and which states may compare by identity.
+
+    """
+    return [
+        value for value in getattr(state, '__dict__', {}).values()
+        if type(value).__module__ != 'builtins' and not isinstance(value, State)
+    ]
+
+
+class SharedPickler(pickle.Pickler):
+    """Pickle states, referring to their shared objects by number."""
+    def __init__(self, file, shared):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.shared_ids = {id(obj): i for i, obj in enumerate(shared)}
+
+    def persistent_id(self, obj):
+        return self.shared_ids.get(id(obj))
+
+
+class SharedUnpickler(pickle.Unpickler):
+    """Unpickle states pickled by SharedPickler, using our own shared objects."""
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+def dump_states(obj, shared):
+    f = io.BytesIO()
+    SharedPickler(f, shared).dump(obj)
+    return f.getvalue()
+
+
+def load_states(data, shared):
+    return SharedUnpickler(io.BytesIO(data), shared).load()
+
+
+def owner(state, num_workers):
+    """Which of `num_workers` ParallelAStar workers owns `state`.
+
+    hash() of str and bytes is salted differently in each process, so ints
+    are used as they are, and other keys are hashed through their pickle.
+
+    """
+    key = state.key()
+    if not isinstance(key, int):
+        key = zlib.crc32(pickle.dumps(key))
+    return key % num_workers
+
+
+def hda_worker(conn, start_state, index, num_workers, batch_size):
+    """One process of a ParallelAStar search.
+
+    Owns the states whose `owner` is `index`.  Each round it
+    receives batches of (state, cost) pairs, expands up to `batch_size` of its
+    own candidates, and sends back the successors owned by other workers.
+
+    """
+    inf = float('inf')
+    shared = shared_objects(start_state)
+    candidates = PriorityQueue()
+    costs = {}
+
+    def add_candidate(state, cost, total_cost):
+        if cost < costs.get(state, inf):
+            costs[state] = cost
+            candidates.add(state, total_cost)
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        incumbent, batches = message
+        for batch in batches:
+            for state, cost in load_states(batch, shared):
+                add_candidate(state, cost, cost + state.guess_completion_cost())
+
+        outboxes = [[] for _ in range(num_workers)]
+        goal_cost = inf
+        lower_bound = inf
+        expanded = 0
+        while candidates and expanded < batch_size:
+            if candidates.min_priority() >= min(incumbent, goal_cost):
+                break
+            best = candidates.pop()
+            cost = costs[best]
+            if best.is_goal():
+                goal_cost = min(goal_cost, cost)
+                continue
+            expanded += 1
+            for nstate, ncost in best.next_states(cost):
+                total_cost = ncost + nstate.guess_completion_cost()
+                if total_cost >= min(incumbent, goal_cost):
+                    continue
+                nowner = owner(nstate, num_workers)
+                if nowner == index:
+                    add_candidate(nstate, ncost, total_cost)
+                else:
+                    outboxes[nowner].append((nstate, ncost))
+                    lower_bound = min(lower_bound, total_cost)
+
+        if candidates:
+            lower_bound = min(lower_bound, candidates.min_priority())
+        batches = [dump_states(outbox, shared) if outbox else None for outbox in outboxes]
+        conn.send((goal_cost, lower_bound, expanded, batches))
+
+
+class ParallelAStar:
+    """Hash-distributed A* (HDA*) across worker processes.
+
+    Each worker owns the states whose keys hash to it (see `owner`), with its
+    own candidates and costs.  The search runs in rounds: every worker expands
+    a batch of its candidates, and the successors it generated for other
+    workers are delivered at the start of the next round.  States can be expanded more than
+    once if a cheaper path to them shows up later, so the search is done when
+    the cheapest goal found is no more than the lowest total cost of any
+    candidate or undelivered successor.
+
+    States must be picklable.  The objects they share (see `shared_objects`)
+    are sent to each worker once, with the start state.
+
+    """
+    def __init__(self, workers=None, batch_size=1000):
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
 
     def search(self, start_state, log=False):
         inf = float('inf')
         should_log = OnceEvery(seconds=5)
-        self.add_candidate(start_state, 0)
-        self.came_from[start_state] = None
+        shared = shared_objects(start_state)
+        conns = []
+        processes = []
+        for index in range(self.workers):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=hda_worker,
+                args=(child_conn, start_state, index, self.workers, self.batch_size),
+                daemon=True,
+            )
+            process.start()
+            conns.append(conn)
+            processes.append(process)
+
+        inboxes = [[] for _ in range(self.workers)]
+        inboxes[owner(start_state, self.workers)].append(dump_states([(start_state, 0)], shared))
+        incumbent = inf
+        expanded = 0
         try:
             while True:
-                try:
-                    best = self.candidates.pop()
-                except IndexError:
-                    raise Exception("No solution") from None
-                cost = self.costs[best]
-                if best.is_goal():
-                    return cost
+                for conn, inbox in zip(conns, inboxes):
+                    conn.send((incumbent, inbox))
+                inboxes = [[] for _ in range(self.workers)]
+                lower_bound = inf
+                for conn in conns:
+                    goal_cost, worker_bound, worker_expanded, batches = conn.recv()
+                    incumbent = min(incumbent, goal_cost)
+                    lower_bound = min(lower_bound, worker_bound)
+                    expanded += worker_expanded
+                    for inbox, batch in zip(inboxes, batches):
+                        if batch is not None:
+                            inbox.append(batch)
                 if log and should_log.now():
-                    print(f"cost {cost}; {len(self.visited)} visited, {len(self.candidates)} candidates, {best.summary()}")
-                self.visited.add(best)
-                for nstate, ncost in best.next_states(cost):
-                    if nstate in self.visited:
-                        continue
-                    old_cost = self.costs.get(nstate, inf)
-                    if ncost < old_cost:
-                        self.add_candidate(nstate, ncost)
-                        self.came_from[nstate] = best
+                    print(f"best {incumbent}, bound {lower_bound}; {expanded} expanded")
+                if incumbent <= lower_bound:
+                    if incumbent == inf:
+                        raise Exception("No solution")
+                    return incumbent
         finally:
             if log:
-                print(f"{len(self.visited)} visited, {len(self.candidates)} candidates remaining")
+                print(f"{expanded} expanded by {self.workers} workers")
+            for conn in conns:
+                conn.send(None)
+            for process in processes:
+                process.join()
+
+
+def search(
+    start_state, log=False, bidirectional=False, goal_states=None, max_visited=None,
+    queue_class=PriorityQueue, integral=False, workers=None, stats=None, checkpoint=None,
+    path=False,
+):
+    """Search a state space, starting with `start_state`. Returns the cost to reach the goal.
+
+    With `bidirectional`, also search backward from `goal_states`, which must
+    be all of the goal states, and must implement `previous_states`.
+
+    With `max_visited`, switch from A* to IDA* once that many states have been
+    visited.  Use 0 to use IDA* from the start.
+
+    `queue_class` is the priority queue for candidates, one of the classes in
+    priqueue.  Declaring costs `integral` (all move costs and guesses are
+    non-negative integers) uses a BucketQueue.
+
+    With `workers`, run a ParallelAStar search in that many processes.
+
+    `stats` is a SearchStats to count and report progress with.
+
+    `checkpoint` is a directory to save progress to every minute or so.  If it
+    has a checkpoint from an earlier search, the search resumes from there.
+
+    With `path`, return a tuple: the cost, and the list of states from
+    `start_state` to the goal.  Bidirectional and parallel searches can't
+    provide paths.
+
+    """
+    if path and (bidirectional or workers):
+        raise ValueError("Only A* and IDA* searches can provide paths")
+    if bidirectional:
+        if goal_states is None:
+            raise ValueError("A bidirectional search needs goal_states")
+        return BidirectionalAStar().search(start_state, goal_states, log)
+    if workers:
+        return ParallelAStar(workers).search(start_state, log)
+    astar = AStar(max_visited, queue_class, integral, stats, checkpoint)
+    return astar.search(start_state, log, path)
+
+
+def anytime_search(start_state, log=False, weight=2.5, weight_step=0.5, seconds=None, max_expansions=None):
+    """Search for a good solution within a budget, using AnytimeAStar.
+
+    Returns (cost, bound): the cost of the best solution found within
+    `seconds` or `max_expansions`, and a bound on how far from optimal it is:
+    cost <= bound * optimal.
+
+    """
+    anytime = AnytimeAStar(weight, weight_step, seconds, max_expansions)
+    return anytime.search(start_state, log)
+
+
+async def search_async(start_state, expansions=1000, seconds=None, path=False, **kwargs):
+    """Search with AStar, yielding to other asyncio tasks every `expansions` states.
 
+    Raises TimeoutError if the search takes more than `seconds`.  Cancelling
+    the task cancels the search.  Other keyword arguments are passed to AStar.
 
-def search(start_state, log=False):
-    """Search a state space, starting with `start_state`. Returns the cost to reach the goal."""
-    return AStar().search(start_state, log)
+    """
+    stepper = SearchStepper(start_state, expansions, seconds, path, **kwargs)
+    return await stepper.run_async()
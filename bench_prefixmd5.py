@@ -0,0 +1,71 @@
+"""Compare prefixmd5 with hashing each string from scratch, as days 5, 14 and 17 did.
+
+    $ python bench_prefixmd5.py
+
+"""
+
+import hashlib
+import itertools
+import time
+
+import day05
+import day14
+import prefixmd5
+
+COUNT = 200000
+
+
+def per_call_zero_hashes(door_id, start, stop):
+    hits = []
+    for index in range(start, stop):
+        h = hashlib.md5(f"{door_id}{index}".encode("ascii")).hexdigest()
+        if h.startswith("00000"):
+            hits.append((index, h))
+    return hits
+
+def per_call_digests(salt):
+    for i in itertools.count():
+        yield hashlib.md5(f"{salt}{i}".encode("ascii")).digest()
+
+def per_call_paths(passcode, paths):
+    return [hashlib.md5((passcode + path).encode("ascii")).hexdigest() for path in paths]
+
+def prefix_paths(passcode, paths):
+    md5 = prefixmd5.hasher(passcode)
+    return [md5.hexdigest(path) for path in paths]
+
+
+def workloads():
+    """Produce (name, old, new): the per-call and prefixmd5 ways to do the same work."""
+    start, stop = 3000000, 3000000 + COUNT
+    yield (
+        "day05 zero hashes",
+        lambda: per_call_zero_hashes("abc", start, stop),
+        lambda: day05.zero_hashes_in_range("abc", start, stop),
+    )
+    yield (
+        "day14 digests",
+        lambda: list(itertools.islice(per_call_digests("zpqevtbw"), COUNT)),
+        lambda: list(itertools.islice(day14.digests("zpqevtbw"), COUNT)),
+    )
+    paths = ["".join("UDLR"[(i >> (2 * j)) & 3] for j in range(12)) for i in range(COUNT)]
+    yield (
+        "day17 paths",
+        lambda: per_call_paths("njfxhljp", paths),
+        lambda: prefix_paths("njfxhljp", paths),
+    )
+
+
+def bench(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"{'workload':20} {'per call':>9} {'prefix':>9} {'speedup':>8}")
+    for name, old, new in workloads():
+        old_result, old_time = bench(old)
+        new_result, new_time = bench(new)
+        assert old_result == new_result
+        print(f"{name:20} {old_time:8.3f}s {new_time:8.3f}s {old_time / new_time:7.2f}x")
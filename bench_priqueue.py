@@ -0,0 +1,39 @@
+"""Compare the priority queues in priqueue on the day22 and day24 searches.
+
+    $ python bench_priqueue.py
+
+"""
+
+import time
+
+from astar import AStar
+from priqueue import BucketQueue, IndexedPriorityQueue, PriorityQueue
+
+
+def searches():
+    """Produce (name, start_state) pairs to search."""
+    import day22
+    yield "day22", day22.MemMoveState(day22.nodes)
+
+    import day24
+    with open("day24_input.txt") as finput:
+        ducts = day24.Ducts.read(finput).trim()
+    yield "day24", day24.DuctExplorerState(ducts)
+
+
+def bench(start_state, queue_class):
+    astar = AStar(queue_class=queue_class)
+    start = time.perf_counter()
+    cost = astar.search(start_state)
+    elapsed = time.perf_counter() - start
+    heap_size = len(getattr(astar.candidates, "q", astar.candidates))
+    return cost, elapsed, astar.num_visited, heap_size, len(astar.candidates)
+
+
+if __name__ == "__main__":
+    start_states = list(searches())
+    print(f"{'search':8} {'queue':22} {'cost':>5} {'seconds':>8} {'visited':>9} {'heap':>9} {'live':>9}")
+    for name, start_state in start_states:
+        for queue_class in [PriorityQueue, IndexedPriorityQueue, BucketQueue]:
+            cost, elapsed, visited, heap_size, live = bench(start_state, queue_class)
+            print(f"{name:8} {queue_class.__name__:22} {cost:5} {elapsed:8.2f} {visited:9,d} {heap_size:9,d} {live:9,d}")
@@ -2,47 +2,115 @@
 #
 # http://adventofcode.com/2016/day/5
 
-import hashlib
+import collections
 import itertools
+import multiprocessing
+import os
 
 import pytest
 
-def zero_hashes(door_id):
-    for index in itertools.count():
-        if index % 1000 == 0:
-            yield index, None
-        h = hashlib.md5(f"{door_id}{index}".encode("ascii")).hexdigest()
-        if h.startswith("00000"):
-            yield index, h
+import prefixmd5
 
-def door_password_digits(door_id):
-    for _, zero_hash in zero_hashes(door_id):
-        yield zero_hash[5]
+def zero_hashes(door_id, workers=None, chunk_size=100000, start=0):
+    """Produce (index, hash) for the hashes starting with five zeros.
 
-def door_password(door_id):
-    return "".join(itertools.islice(door_password_digits(door_id), 8))
+    Every thousand indexes, (index, None) is produced, to show progress.
+    With `workers`, hash in that many processes, `chunk_size` indexes at a
+    time, producing the same results in the same order.  Indexes begin at
+    `start`.
 
-def test_door_password():
-    assert door_password("abc") == "18f47a30"
+    """
+    if workers:
+        yield from parallel_zero_hashes(door_id, workers, chunk_size, start)
+        return
+    for stop in itertools.count(start - start % 1000 + 1000, 1000):
+        if start % 1000 == 0:
+            yield start, None
+        yield from zero_hashes_in_range(door_id, start, stop)
+        start = stop
 
-def password_digit_positions_with_counting(door_id):
-    for hashes, zero_hash in zero_hashes(door_id):
+def zero_hashes_in_range(door_id, start, stop):
+    """The (index, hash) pairs from `zero_hashes` with start <= index < stop."""
+    digests = prefixmd5.hash_range(door_id, start, stop - start)
+    # Five hex zeros are two zero bytes and a byte less than 16.  Finding the
+    # zero bytes is much quicker than examining each digest.
+    hits = []
+    pos = digests.find(b"\0\0")
+    while pos != -1:
+        if pos % prefixmd5.DIGEST_SIZE == 0 and digests[pos + 2] < 16:
+            digest = digests[pos:pos + prefixmd5.DIGEST_SIZE]
+            hits.append((start + pos // prefixmd5.DIGEST_SIZE, digest.hex()))
+        pos = digests.find(b"\0\0", pos + 1)
+    return hits
+
+def parallel_zero_hashes(door_id, workers, chunk_size, start=0):
+    with multiprocessing.Pool(workers) as pool:
+        # Keep every worker busy with a couple of chunks, and take the
+        # results in order of their starting index.
+        chunk_starts = itertools.count(start, chunk_size)
+        pending = collections.deque()
+        for start in itertools.islice(chunk_starts, 2 * workers):
+            pending.append((start, pool.apply_async(zero_hashes_in_range, (door_id, start, start + chunk_size))))
+        while True:
+            start, result = pending.popleft()
+            hits = collections.deque(result.get())
+            next_start = next(chunk_starts)
+            pending.append((next_start, pool.apply_async(zero_hashes_in_range, (door_id, next_start, next_start + chunk_size))))
+
+            for index in range(-(-start // 1000) * 1000, start + chunk_size, 1000):
+                while hits and hits[0][0] < index:
+                    yield hits.popleft()
+                yield index, None
+            yield from hits
+
+def test_parallel_zero_hashes():
+    serial = list(itertools.islice(zero_hashes("abc"), 10))
+    assert list(itertools.islice(zero_hashes("abc", workers=2, chunk_size=1500), 10)) == serial
+    # The first hit is at 3231929.  Start mid-thousand, with chunks that
+    # don't line up with the progress markers, so the hit lands inside a
+    # chunk that also holds a marker.
+    serial = list(itertools.islice(zero_hashes("abc", start=3230500), 5))
+    assert serial == [
+        (3231000, None),
+        (3231929, "00000155f8105dff7f56ee10fa9b9abd"),
+        (3232000, None),
+        (3233000, None),
+        (3234000, None),
+    ]
+    assert list(itertools.islice(zero_hashes("abc", workers=2, chunk_size=700, start=3230500), 5)) == serial
+
+def door_password_digits(door_id, workers=None):
+    for _, zero_hash in zero_hashes(door_id, workers):
+        if zero_hash is not None:
+            yield zero_hash[5]
+
+def door_password(door_id, workers=None):
+    return "".join(itertools.islice(door_password_digits(door_id, workers), 8))
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_door_password(workers):
+    assert door_password("abc", workers) == "18f47a30"
+
+def password_digit_positions_with_counting(door_id, workers=None):
+    for hashes, zero_hash in zero_hashes(door_id, workers):
         if zero_hash is not None:
             yield hashes, int(zero_hash[5], 16), zero_hash[6]
         else:
             yield hashes, None, None
 
-def password_digit_positions(door_id):
-    for hashes, position, digit in password_digit_positions_with_counting(door_id):
+def password_digit_positions(door_id, workers=None):
+    for hashes, position, digit in password_digit_positions_with_counting(door_id, workers):
         if position is not None:
             yield position, digit
 
-def test_password_digit_positions():
-    assert list(itertools.islice(password_digit_positions("abc"), 3)) == [(1, "5"), (8, "f"), (15, "9")]
+@pytest.mark.parametrize("workers", [None, 2])
+def test_password_digit_positions(workers):
+    positions = password_digit_positions("abc", workers)
+    assert list(itertools.islice(positions, 3)) == [(1, "5"), (8, "f"), (15, "9")]
 
-def print_decrypting_password(door_id):
+def print_decrypting_password(door_id, workers=None):
     digits = ["_"] * 8
-    for hashes, position, digit in password_digit_positions_with_counting(door_id):
+    for hashes, position, digit in password_digit_positions_with_counting(door_id, workers):
         if position is not None:
             if position < len(digits) and digits[position] == '_':
                 digits[position] = digit
@@ -54,8 +122,10 @@ def print_decrypting_password(door_id):
 if __name__ == "__main__":
     door_id = "reyedfim"
 
-    password = door_password(door_id)
+    workers = os.cpu_count()
+
+    password = door_password(door_id, workers)
     print(f"Puzzle 1: the password for {door_id} is {password}")
 
     print("Puzzle 2:")
-    print_decrypting_password(door_id)
+    print_decrypting_password(door_id, workers)
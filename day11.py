@@ -2,12 +2,21 @@
 #
 # http://adventofcode.com/2016/day/11
 
+import array
+import bisect
 import collections
+import functools
 import itertools
+import multiprocessing
+import os
 import textwrap
+import time
 
 import pytest
 
+from astar import State, search
+from extsearch import LayeredSearch
+
 class Floors:
     def __init__(self, things):
         # What floor is the elevator on?
@@ -37,6 +46,42 @@ class Floors:
     def __hash__(self):
         return hash((self.elevator, tuple(self.things.items())))
 
+    def pairs(self):
+        """The sorted (generator floor, microchip floor) pairs, one per element."""
+        elements = set(thing[0] for thing in self.things)
+        return sorted((self.things[e+'G'], self.things[e+'M']) for e in elements)
+
+    def key(self):
+        """A key that ignores which element is which.
+
+        Swapping the floors of two elements' pairs makes a configuration that
+        is just as far from the finish, so they can share a key.
+
+        """
+        return (self.elevator, tuple(self.pairs()))
+
+    def canonical(self):
+        """An equivalent Floors, with the pairs in order of element name."""
+        elements = sorted(set(thing[0] for thing in self.things))
+        things = {}
+        for element, (gfloor, mfloor) in zip(elements, self.pairs()):
+            things[element+'G'] = gfloor
+            things[element+'M'] = mfloor
+        new = Floors(things)
+        new.elevator = self.elevator
+        return new
+
+    def encode(self):
+        """A compact byte string for this configuration: see `decode`."""
+        return bytes([self.elevator] + [self.things[thing] for thing in sorted(self.things)])
+
+    @classmethod
+    def decode(cls, names, data):
+        """Make a Floors from `encode` output, and the sorted names of things."""
+        new = cls(zip(names, data[1:]))
+        new.elevator = data[0]
+        return new
+
     def steps_from_start(self):
         steps = 0
         here = self
@@ -199,6 +244,24 @@ def test_hash(thingss, num_different):
     s = set(Floors(t) for t in thingss)
     assert len(s) == num_different
 
+@pytest.mark.parametrize("things", [
+    SAMPLE_DATA,
+    PUZZLE_INPUT,
+])
+def test_encode_decode(things):
+    floors = Floors(things)
+    floors.elevator = 3
+    assert Floors.decode(sorted(things), floors.encode()) == floors
+
+def test_key():
+    # Swapping two elements' floors makes an equivalent configuration.
+    floors = Floors(SAMPLE_DATA)
+    swapped = Floors({"HM": 1, "LM": 1, "HG": 3, "LG": 2})
+    assert floors != swapped
+    assert floors.key() == swapped.key()
+    assert floors.canonical() == swapped.canonical()
+    assert floors.key() != Floors(PUZZLE_INPUT).key()
+
 def test_next_states():
     floors = Floors(PUZZLE_INPUT)
     floors.elevator = 2
@@ -208,7 +271,7 @@ def test_next_states():
 def find_finish(floors):
     """Find a way to the finish."""
     to_try = [floors]
-    seen = set([floors])
+    seen = set([floors.key()])
     for gen in itertools.count(start=1):
         next_to_try = []
         for floors in to_try:
@@ -220,8 +283,9 @@ def find_finish(floors):
             for next_floors in floors.next_states():
                 #print("-"*40)
                 #print(next_floors.show())
-                if next_floors not in seen:
-                    seen.add(next_floors)
+                key = next_floors.key()
+                if key not in seen:
+                    seen.add(key)
                     if next_floors.is_finished():
                         return next_floors
                     else:
@@ -229,6 +293,404 @@ def find_finish(floors):
         print(f"Gen {gen}, seen {len(seen)} states")
         to_try = next_to_try
 
+def find_finish_external(floors, **kwargs):
+    """Find the number of steps to the finish, keeping the search on disk."""
+    names = sorted(floors.things)
+    searcher = LayeredSearch(
+        lambda floors: floors.canonical().encode(),
+        functools.partial(Floors.decode, names),
+        keep_layers=2,
+        **kwargs
+    )
+    return searcher.search(floors, Floors.next_states, Floors.is_finished)
+
+def test_find_finish_external(tmp_path):
+    assert find_finish_external(Floors(SAMPLE_DATA), workdir=tmp_path, run_size=10) == 11
+
+
+class PackedFloors:
+    """Floors configurations packed into single ints.
+
+    Each thing's floor (minus one) takes two bits.  With n elements, element
+    i's generator is at bit 2*i, its microchip at bit 2*(n+i), and the
+    elevator at bit 4*n.  Sets of things are masks with the low bit of each
+    of their two-bit fields set.
+
+    """
+    def __init__(self, elements):
+        self.elements = sorted(elements)
+        n = self.n = len(self.elements)
+        self.elevator_shift = 4 * n
+        self.things_mask = (1 << 4 * n) - 1
+        self.generators_mask = (1 << 2 * n) - 1
+        # The low bit of every field.
+        self.low_bits = self.things_mask // 3
+        # Every field set to floor f, indexed by f-1.
+        self.all_on = [self.low_bits * f for f in range(4)]
+
+    @classmethod
+    def for_floors(cls, floors):
+        return cls(set(thing[0] for thing in floors.things))
+
+    def pack(self, floors):
+        code = (floors.elevator - 1) << self.elevator_shift
+        for i, element in enumerate(self.elements):
+            code |= (floors.things[element+'G'] - 1) << (2 * i)
+            code |= (floors.things[element+'M'] - 1) << (2 * (self.n + i))
+        return code
+
+    def unpack(self, code):
+        things = {}
+        for i, element in enumerate(self.elements):
+            things[element+'G'] = ((code >> (2 * i)) & 3) + 1
+            things[element+'M'] = ((code >> (2 * (self.n + i))) & 3) + 1
+        floors = Floors(things)
+        floors.elevator = (code >> self.elevator_shift) + 1
+        return floors
+
+    def on_floor(self, code, floor):
+        """The mask of things on `floor`, numbered from zero."""
+        same = ~(code ^ self.all_on[floor]) & self.things_mask
+        return same & (same >> 1) & self.low_bits
+
+    def floor_is_valid(self, code, floor):
+        here = self.on_floor(code, floor)
+        generators = here & self.generators_mask
+        chips = here >> (2 * self.n)
+        return not generators or not (chips & ~generators)
+
+    def is_finished(self, code):
+        return code & self.things_mask == self.all_on[3]
+
+    def canonical(self, code):
+        """The code for the equivalent configuration with pairs in sorted order."""
+        n = self.n
+        pairs = sorted(((code >> (2 * i)) & 3, (code >> (2 * (n + i))) & 3) for i in range(n))
+        canon = code & ~self.things_mask
+        for i, (gfloor, mfloor) in enumerate(pairs):
+            canon |= (gfloor << (2 * i)) | (mfloor << (2 * (n + i)))
+        return canon
+
+    def floor_counts(self, code):
+        """How many things are on each of the four floors."""
+        return [bin(self.on_floor(code, floor)).count('1') for floor in range(4)]
+
+    def next_states(self, code):
+        """Produce the codes reachable in one move from `code`."""
+        floor = code >> self.elevator_shift
+        here = self.on_floor(code, floor)
+        for direction in (1, -1):
+            new_floor = floor + direction
+            if not 0 <= new_floor <= 3:
+                continue
+            moved = code + direction * (1 << self.elevator_shift)
+            singles = here
+            while singles:
+                bit = singles & -singles
+                singles ^= bit
+                new = moved + direction * bit
+                if self.floor_is_valid(new, floor) and self.floor_is_valid(new, new_floor):
+                    yield new
+                others = singles
+                while others:
+                    other = others & -others
+                    others ^= other
+                    new = moved + direction * (bit + other)
+                    if self.floor_is_valid(new, floor) and self.floor_is_valid(new, new_floor):
+                        yield new
+
+
+def find_finish_packed(floors):
+    """Find the number of steps to the finish, with packed configurations."""
+    packed = PackedFloors.for_floors(floors)
+    to_try = [packed.pack(floors)]
+    seen = {packed.canonical(to_try[0])}
+    for gen in itertools.count(start=1):
+        next_to_try = []
+        for code in to_try:
+            for next_code in packed.next_states(code):
+                key = packed.canonical(next_code)
+                if key not in seen:
+                    seen.add(key)
+                    if packed.is_finished(next_code):
+                        return gen
+                    next_to_try.append(next_code)
+        if not next_to_try:
+            raise Exception("No way to finish")
+        to_try = next_to_try
+
+class CompactSearch:
+    """A breadth-first search over packed codes that keeps no Floors.
+
+    The canonical codes found are stored in order in an array, and `layers`
+    has the index where each generation starts, so a code's generation is
+    its position.  With `parents`, an array of each code's parent index is
+    kept too.  Nothing else outlives the search but the seen set.
+
+    """
+    def __init__(self, floors, parents=False):
+        self.packed = PackedFloors.for_floors(floors)
+        self.start = self.packed.pack(floors)
+        self.codes = array.array('Q', [self.packed.canonical(self.start)])
+        self.parents = array.array('q', [-1]) if parents else None
+        self.layers = [0]
+        self.finish = None
+
+    def search(self):
+        """Find the number of steps to the finish."""
+        packed = self.packed
+        codes = self.codes
+        if packed.is_finished(codes[0]):
+            self.finish = 0
+            return 0
+        seen = set(codes)
+        for gen in itertools.count(start=1):
+            begin, end = self.layers[-1], len(codes)
+            if begin == end:
+                raise Exception("No way to finish")
+            self.layers.append(end)
+            for index in range(begin, end):
+                for next_code in packed.next_states(codes[index]):
+                    key = packed.canonical(next_code)
+                    if key not in seen:
+                        seen.add(key)
+                        codes.append(key)
+                        if self.parents is not None:
+                            self.parents.append(index)
+                        if packed.is_finished(key):
+                            self.finish = len(codes) - 1
+                            return gen
+
+    def generation(self, index):
+        """How many steps from the start the code at `index` is."""
+        return bisect.bisect_right(self.layers, index) - 1
+
+    def parent(self, index):
+        """The index of a code one step before the code at `index`."""
+        if self.parents is not None:
+            return self.parents[index]
+        # Look through the previous generation for a code that leads here.
+        gen = self.generation(index)
+        code = self.codes[index]
+        for parent in range(self.layers[gen-1], self.layers[gen]):
+            for next_code in self.packed.next_states(self.codes[parent]):
+                if self.packed.canonical(next_code) == code:
+                    return parent
+        raise Exception(f"No parent for {index}")
+
+    def path(self):
+        """The Floors from the start to the finish found by `search`."""
+        keys = []
+        index = self.finish
+        while index:
+            keys.append(self.codes[index])
+            index = self.parent(index)
+        # The stored codes are canonical, with elements shuffled from one to
+        # the next.  Replay the moves from the start to keep them straight.
+        code = self.start
+        path = [self.packed.unpack(code)]
+        for key in reversed(keys):
+            code = next(c for c in self.packed.next_states(code) if self.packed.canonical(c) == key)
+            path.append(self.packed.unpack(code))
+        return path
+
+def shard_worker(conn, elements, index, num_shards):
+    """One process of find_finish_parallel.
+
+    Owns the configurations whose canonical key modulo `num_shards` is
+    `index`, and the part of the seen set that holds them.  Each generation
+    it receives dicts of key: code from the other workers, keeps the codes it
+    hasn't seen, and expands them.  It reports whether any of them is
+    finished, how many there were, and dicts of their successors for each
+    of the other workers.  Its own successors stay here for next time.
+
+    """
+    packed = PackedFloors(elements)
+    seen = set()
+    mine = {}
+    while True:
+        batches = conn.recv()
+        if batches is None:
+            break
+        layer = []
+        for batch in batches + [mine]:
+            for key, code in batch.items():
+                if key not in seen:
+                    seen.add(key)
+                    layer.append(code)
+        finished = any(packed.is_finished(code) for code in layer)
+        outboxes = [{} for _ in range(num_shards)]
+        if not finished:
+            for code in layer:
+                for next_code in packed.next_states(code):
+                    key = packed.canonical(next_code)
+                    outboxes[key % num_shards][key] = next_code
+        mine = outboxes[index]
+        outboxes[index] = None
+        conn.send((finished, len(layer), outboxes))
+
+def find_finish_parallel(floors, workers=None, log=False):
+    """Find the number of steps to the finish, one generation at a time in parallel.
+
+    The configurations are sharded by canonical key across `workers`
+    processes.  Each process owns its shard of the seen set, so merging the
+    successors into the seen set is as parallel as expanding them.
+
+    """
+    packed = PackedFloors.for_floors(floors)
+    workers = workers or os.cpu_count()
+    conns = []
+    processes = []
+    for index in range(workers):
+        conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=shard_worker,
+            args=(child_conn, packed.elements, index, workers),
+            daemon=True,
+        )
+        process.start()
+        conns.append(conn)
+        processes.append(process)
+
+    start = packed.pack(floors)
+    key = packed.canonical(start)
+    inboxes = [[] for _ in range(workers)]
+    inboxes[key % workers].append({key: start})
+    try:
+        for gen in itertools.count():
+            start_time = time.perf_counter()
+            for conn, inbox in zip(conns, inboxes):
+                conn.send(inbox)
+            inboxes = [[] for _ in range(workers)]
+            finished = False
+            num_states = 0
+            for conn in conns:
+                worker_finished, worker_states, outboxes = conn.recv()
+                finished = finished or worker_finished
+                num_states += worker_states
+                for inbox, outbox in zip(inboxes, outboxes):
+                    if outbox:
+                        inbox.append(outbox)
+            if log:
+                print(f"Gen {gen}: {num_states} states, {time.perf_counter() - start_time:.3f}s")
+            if finished:
+                return gen
+            if not num_states:
+                raise Exception("No way to finish")
+    finally:
+        for conn in conns:
+            conn.send(None)
+        for process in processes:
+            process.join()
+
+class FloorsState(State):
+    """An astar.State for a packed Floors configuration."""
+    def __init__(self, packed, code):
+        self.packed = packed
+        self.code = code
+
+    def __repr__(self):
+        return f"<FloorsState {self.code:#x}>"
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __eq__(self, other):
+        return self.key() == other.key()
+
+    def key(self):
+        return self.packed.canonical(self.code)
+
+    def is_goal(self):
+        return self.packed.is_finished(self.code)
+
+    def next_states(self, cost):
+        for code in self.packed.next_states(self.code):
+            yield self.__class__(self.packed, code), cost + 1
+
+    def guess_completion_cost(self):
+        # Every move crosses one of the three boundaries between floors, so
+        # add up how many times each boundary must be crossed.  To get c
+        # things up across a boundary with the elevator below it, each trip
+        # up carries at most two, and each trip but the last has to bring
+        # someone back down: 2c-3 crossings (just one when c is 1).  With
+        # the elevator above it, first someone has to come down, leaving c+1
+        # things below, so 1 + 2(c+1)-3 = 2c crossings.
+        counts = self.packed.floor_counts(self.code)
+        elevator = self.code >> self.packed.elevator_shift
+        guess = 0
+        below = 0
+        for boundary in range(3):
+            below += counts[boundary]
+            if below == 0:
+                continue
+            if elevator <= boundary:
+                guess += max(1, 2 * below - 3)
+            else:
+                guess += 2 * below
+        return guess
+
+    def summary(self):
+        return f"counts {self.packed.floor_counts(self.code)}"
+
+
+def find_finish_astar(floors, **kwargs):
+    """Find the number of steps to the finish with A*.
+
+    Keyword arguments are passed to astar.search.
+
+    """
+    packed = PackedFloors.for_floors(floors)
+    return search(FloorsState(packed, packed.pack(floors)), integral=True, **kwargs)
+
+@pytest.mark.parametrize("things", [
+    SAMPLE_DATA,
+    PUZZLE_INPUT,
+])
+def test_packed_floors(things):
+    floors = Floors(things)
+    packed = PackedFloors.for_floors(floors)
+    for elevator in range(1, 5):
+        floors.elevator = elevator
+        code = packed.pack(floors)
+        assert packed.unpack(code) == floors
+        assert packed.is_finished(code) == floors.is_finished()
+        expected = set(packed.pack(f) for f in floors.next_states())
+        assert set(packed.next_states(code)) == expected
+
+def test_find_finish_packed():
+    assert find_finish_packed(Floors(SAMPLE_DATA)) == 11
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_find_finish_parallel(workers):
+    floors = Floors(SAMPLE_DATA)
+    assert find_finish_parallel(floors, workers=workers) == 11
+
+@pytest.mark.parametrize("parents", [False, True])
+def test_compact_search(parents):
+    floors = Floors(SAMPLE_DATA)
+    searcher = CompactSearch(floors, parents=parents)
+    assert searcher.search() == 11
+    assert searcher.generation(searcher.finish) == 11
+    path = searcher.path()
+    assert len(path) == 12
+    assert path[0] == floors
+    assert path[-1].is_finished()
+    for here, there in zip(path, path[1:]):
+        assert there in list(here.next_states())
+
+def test_find_finish_astar():
+    assert find_finish_astar(Floors(SAMPLE_DATA)) == 11
+    assert find_finish_astar(Floors(PUZZLE_INPUT)) == 37
+
+def test_floors_state_guess():
+    floors = Floors(SAMPLE_DATA)
+    packed = PackedFloors.for_floors(floors)
+    # Boundaries with 2, 3, and 4 things below, elevator on the first floor.
+    assert FloorsState(packed, packed.pack(floors)).guess_completion_cost() == 1 + 3 + 5
+    floors.elevator = 3
+    assert FloorsState(packed, packed.pack(floors)).guess_completion_cost() == 4 + 6 + 5
+
 finish = find_finish(Floors(SAMPLE_DATA))
 print(f"Found a sample finish in {finish.steps_from_start()} steps")
 
@@ -240,5 +702,5 @@ if 0:
 PUZZLE2_INPUT = dict(PUZZLE_INPUT, **{"DM": 1, "DG": 1, "EM": 1, "EG": 1})
 if 1:
     print("*"*40)
-    finish = find_finish(Floors(PUZZLE2_INPUT))
-    print(f"Found a puzzle 2 finish in {finish.steps_from_start()} steps")
+    steps = find_finish_astar(Floors(PUZZLE2_INPUT))
+    print(f"Found a puzzle 2 finish in {steps} steps")
@@ -2,13 +2,21 @@
 #
 # http://adventofcode.com/2016/day/14
 
+import array
+import bisect
 import collections
+import functools
 import hashlib
 import itertools
+import mmap
+import multiprocessing
+import os
 import re
 
 import pytest
 
+import prefixmd5
+
 def triple(s):
     """Return the character that occurs as a triple, or None."""
     m = re.search(r"(.)\1\1", s)
@@ -23,11 +31,30 @@ def triple(s):
 def test_triple(s, t):
     assert triple(s) == t
 
+def quints(s):
+    """Return the set of characters that occur five in a row."""
+    return set(re.findall(r"(.)\1{4}", s))
+
+@pytest.mark.parametrize("s, q", [
+    ("hello there", set()),
+    ("aaaa", set()),
+    ("aaaaa", {"a"}),
+    ("0123333334xxxxx112315zzzz124", {"3", "x"}),
+])
+def test_quints(s, q):
+    assert quints(s) == q
+
+
+def digests(salt, start=0):
+    """Produce the md5 digests of salt+start, salt+start+1, ..."""
+    md5 = prefixmd5.PrefixMD5(salt)
+    for i in itertools.count(start):
+        yield md5.digest_int(i)
 
 def hashes(salt):
     """Produce the hashes of salt+0, salt+1, ..."""
-    for i in itertools.count():
-        yield i, hashlib.md5(f"{salt}{i}".encode("ascii")).hexdigest()
+    for i, digest in enumerate(digests(salt)):
+        yield i, digest.hex()
 
 @pytest.mark.parametrize("salt, first_three", [
     ("abc", [
@@ -75,31 +102,189 @@ def test_finite_peekable():
     p = PeekableIterable(range(3))
     assert list(p) == [0, 1, 2]
 
-def key_indexes(salt, hashes):
-    """Produce successive key indexes from salt."""
-    p = PeekableIterable(hashes(salt))
-    for index, hash in p:
+class RingPeekable:
+    """A lookahead over a stream of raw md5 digests, for finding keys.
+
+    The current digest and up to `capacity` after it are kept in a ring
+    buffer allocated once.  As each digest is read, it is copied into the
+    buffer, and its first triple and its quints are noted in arrays
+    alongside, so looking ahead at them allocates nothing.
+
+    """
+    def __init__(self, digests, capacity, start=0):
+        self.source = iter(digests)
+        self.capacity = capacity
+        self.slots = capacity + 1
+        self.buffer = bytearray(prefixmd5.DIGEST_SIZE * self.slots)
+        self.view = memoryview(self.buffer)
+        # For each slot, the hex digit of the first triple, or -1, and a bit
+        # for each hex digit with a quint.
+        self.triple_digits = array.array('b', [-1]) * self.slots
+        self.quint_masks = array.array('H', [0]) * self.slots
+        self.index = start - 1  # The index of the current digest.
+        self.head = 0           # The slot of the current digest.
+        self.count = 0          # How many digests are in the buffer.
+
+    def __iter__(self):
+        """Move through the digests, producing the index of each."""
+        started = False
+        while True:
+            if started:
+                self.head = (self.head + 1) % self.slots
+                self.count -= 1
+            if not self.count:
+                try:
+                    self.fill()
+                except StopIteration:
+                    return
+            started = True
+            self.index += 1
+            yield self.index
+
+    def fill(self):
+        digest = next(self.source)
+        slot = (self.head + self.count) % self.slots
+        start = slot * prefixmd5.DIGEST_SIZE
+        self.view[start:start + prefixmd5.DIGEST_SIZE] = digest
+        hash = digest.hex()
         t = triple(hash)
         if t:
-            # The hash has a triple, see if there's a quint in any of the next
-            # 1000 hashes.
-            for i in range(1, 1001):
-                _, peek_hash = p.peek(i)
-                if t*5 in peek_hash:
-                    # This is a key!
-                    yield index
+            self.triple_digits[slot] = int(t, 16)
+            # Every quint is a triple, so there can only be quints here.
+            mask = 0
+            for q in quints(hash):
+                mask |= 1 << int(q, 16)
+            self.quint_masks[slot] = mask
+        else:
+            self.triple_digits[slot] = -1
+            self.quint_masks[slot] = 0
+        self.count += 1
+
+    def peek(self, ahead):
+        """The slot of the digest `ahead` after the current one."""
+        if not 0 <= ahead <= self.capacity:
+            raise IndexError(f"Can only peek 0 to {self.capacity} ahead, not {ahead}")
+        while ahead >= self.count:
+            self.fill()
+        return (self.head + ahead) % self.slots
+
+    def triple(self, ahead=0):
+        """The hex digit of the first triple `ahead` after the current digest, or -1."""
+        return self.triple_digits[self.peek(ahead)]
+
+    def quints(self, ahead):
+        """A bit for each hex digit with a quint `ahead` after the current digest."""
+        return self.quint_masks[self.peek(ahead)]
+
+    def digest(self, ahead=0):
+        start = self.peek(ahead) * prefixmd5.DIGEST_SIZE
+        return bytes(self.view[start:start + prefixmd5.DIGEST_SIZE])
+
+def test_ring_peekable():
+    p = RingPeekable(digests("abc"), capacity=100)
+    pi = iter(p)
+    assert next(pi) == 0
+    assert p.digest().hex() == "577571be4de9dcce85a041ba0410f29f"
+    assert next(pi) == 1
+    assert p.digest().hex() == "23734cd52ad4a4fb877d8a1e26e5df5f"
+    assert p.digest(1).hex() == "63872b5565b2179bd72ea9c339192543"
+    assert p.digest(100) == next(itertools.islice(digests("abc"), 101, None))
+    with pytest.raises(IndexError):
+        p.peek(101)
+    assert next(pi) == 2
+    assert p.digest().hex() == "63872b5565b2179bd72ea9c339192543"
+    # 63872b5565b2179bd72ea9c339192543 has no triple; index 18's has 888.
+    assert p.triple() == -1
+    assert p.triple(16) == 8
+    assert list(itertools.islice(pi, 200)) == list(range(3, 203))
+    # Peeking before taking the first digest doesn't lose it.
+    p = RingPeekable(digests("abc", start=5), capacity=10, start=5)
+    first = p.digest(0)
+    assert next(iter(p)) == 5
+    assert p.digest() == first == next(digests("abc", start=5))
+
+def test_ring_peekable_quints():
+    hex_digests = [
+        "aaaaa0123456789b0123456789b01234",
+        "0123456789abcdef0123456789abcdef",
+        "0111112345555556789abcdef0000000",
+    ]
+    p = RingPeekable([bytes.fromhex(h) for h in hex_digests], capacity=2)
+    assert list(p) == [0, 1, 2]
+    p = RingPeekable([bytes.fromhex(h) for h in hex_digests], capacity=2)
+    next(iter(p))
+    assert [p.triple(i) for i in range(3)] == [0xa, -1, 1]
+    assert [p.quints(i) for i in range(3)] == [1 << 0xa, 0, (1 << 1) | (1 << 5) | (1 << 0)]
+
+class QuintIndex:
+    """Where the quints are in the digests coming up in a RingPeekable.
+
+    The ring notes each digest's quints once, as it reads it.  For each hex
+    digit, the sorted indexes of the digests with quints of it are kept
+    here, but only as far back as the window reaches.
+
+    """
+    def __init__(self, ring, window=1000):
+        self.ring = ring
+        self.window = window
+        self.scanned = -1
+        self.positions = [[] for _ in range(16)]
+
+    def has_quint(self, digit, index):
+        """Is there a quint of hex `digit` in the `window` digests after `index`?
+
+        `index` is the index of the ring's current digest.  It can't go
+        backward from one call to the next.
+
+        """
+        for ahead in range(max(1, self.scanned - index + 1), self.window + 1):
+            mask = self.ring.quints(ahead)
+            self.scanned = index + ahead
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                positions = self.positions[bit.bit_length() - 1]
+                # Nothing before the window will be asked about again.
+                del positions[:bisect.bisect_left(positions, self.scanned - self.window)]
+                positions.append(self.scanned)
+        positions = self.positions[digit]
+        after = bisect.bisect_right(positions, index)
+        return after < len(positions) and positions[after] <= index + self.window
+
+def test_quint_index():
+    quint = bytes.fromhex("aaaaa0123456789b0123456789b01234")
+    plain = bytes.fromhex("0123456789abcdef0123456789abcdef")
+    p = RingPeekable([quint if i % 10 == 5 else plain for i in range(30)], capacity=3)
+    quint_index = QuintIndex(p, window=3)
+    pi = iter(p)
+    assert [quint_index.has_quint(0xa, next(pi)) for _ in range(12)] == [
+        False, False, True, True, True, False,
+        False, False, False, False, False, False,
+    ]
+    assert not quint_index.has_quint(0xb, next(pi))
+    assert all(len(positions) <= 1 for positions in quint_index.positions)
+
+def key_indexes(salt, digests):
+    """Produce successive key indexes from salt, hashing with `digests`."""
+    p = RingPeekable(digests(salt), capacity=1000)
+    quint_index = QuintIndex(p, window=1000)
+    for index in p:
+        t = p.triple()
+        # A key has a triple, and a quint of it in any of the next 1000 hashes.
+        if t >= 0 and quint_index.has_quint(t, index):
+            yield index
 
 def test_key_indexes():
-    ki = key_indexes("abc", hashes)
+    ki = key_indexes("abc", digests)
     assert next(ki) == 39
 
-def complete_keys(salt, hashes):
+def complete_keys(salt, digests):
     """Return a list of 64 key indexes for salt."""
-    return list(itertools.islice(key_indexes(salt, hashes), 64))
+    return list(itertools.islice(key_indexes(salt, digests), 64))
 
 def test_complete_keys():
     # The sample from the problem.
-    complete = complete_keys("abc", hashes)
+    complete = complete_keys("abc", digests)
     assert len(complete) == 64
     assert complete[0] == 39
     assert complete[1] == 92
@@ -109,31 +294,127 @@ def test_complete_keys():
 INPUT = 'zpqevtbw'
 
 def puzzle1():
-    complete = complete_keys(INPUT, hashes)
+    complete = complete_keys(INPUT, digests)
     print(f"Puzzle 1: the 64th key is at index {complete[63]}")
 
 
-def stretched_hashes(salt):
-    """Produce the stretched hashes of salt+0, salt+1, ..."""
-    for i in itertools.count():
-        val = hashlib.md5(f"{salt}{i}".encode("ascii")).hexdigest()
-        for _ in range(2016):
-            val = hashlib.md5(val.encode("ascii")).hexdigest()
-        yield i, val
+def stretched_digests(salt, start=0):
+    """Produce the stretched digests of salt+start, salt+start+1, ..."""
+    salted = prefixmd5.PrefixMD5(salt)
+    md5 = hashlib.md5
+    for i in itertools.count(start):
+        val = salted.hexdigest_int(i).encode("ascii")
+        for _ in range(2015):
+            val = md5(val).hexdigest().encode("ascii")
+        yield md5(val).digest()
+
+def stretched_hashes(salt, start=0):
+    """Produce the stretched hashes of salt+start, salt+start+1, ..."""
+    for i, digest in enumerate(stretched_digests(salt, start), start=start):
+        yield i, digest.hex()
 
 def test_stretched_hashes():
     assert next(stretched_hashes("abc")) == (0, "a107ff634856bb300138cac6568c0f24")
 
 def test_complete_keys_stretched():
     # The sample from the problem.
-    complete = complete_keys("abc", stretched_hashes)
+    complete = complete_keys("abc", stretched_digests)
     assert len(complete) == 64
     assert complete[0] == 10
     assert complete[63] == 22551
 
 
+def stretched_digest_range(salt, start, stop):
+    """The stretched digests of salt+start up to salt+stop, concatenated."""
+    return b"".join(itertools.islice(stretched_digests(salt, start), stop - start))
+
+def parallel_stretched_digests(salt, start=0, workers=None, chunk_size=100):
+    """Produce the same as `stretched_digests`, computed ahead in worker processes.
+
+    Chunks of `chunk_size` indexes are handed to a pool of `workers`
+    processes.  Two chunks per worker are in flight at a time, so the pool
+    works ahead of the consumer, but not without limit.
+
+    """
+    workers = workers or os.cpu_count()
+    size = prefixmd5.DIGEST_SIZE
+    with multiprocessing.Pool(workers) as pool:
+        chunk_starts = itertools.count(start, chunk_size)
+        pending = collections.deque()
+
+        def submit():
+            chunk_start = next(chunk_starts)
+            args = (salt, chunk_start, chunk_start + chunk_size)
+            pending.append(pool.apply_async(stretched_digest_range, args))
+
+        for _ in range(2 * workers):
+            submit()
+        while True:
+            chunk = pending.popleft().get()
+            submit()
+            for offset in range(0, len(chunk), size):
+                yield chunk[offset:offset + size]
+
+def test_parallel_stretched_digests():
+    expected = list(itertools.islice(stretched_digests("abc", start=3), 7))
+    parallel = parallel_stretched_digests("abc", start=3, workers=2, chunk_size=2)
+    assert list(itertools.islice(parallel, 7)) == expected
+
+
+CACHE_DIR = "day14_cache"
+
+def cached_stretched_digests(salt, cache_dir=CACHE_DIR, workers=None):
+    """Produce the same as `stretched_digests`, remembering them in a file.
+
+    The file for the salt holds the 16-byte digests in index order.  The
+    ones already there are read through a memory map, and the rest are
+    computed and appended, for next time.  With `workers`, they are computed
+    by `parallel_stretched_digests`.
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"stretched-{salt}.md5")
+    size = prefixmd5.DIGEST_SIZE
+    with open(os.open(path, os.O_RDWR | os.O_CREAT, 0o666), "r+b") as f:
+        # A partial digest at the end, from an interrupted write, is ignored
+        # and overwritten.
+        cached = os.fstat(f.fileno()).st_size // size
+        if cached:
+            with mmap.mmap(f.fileno(), cached * size, access=mmap.ACCESS_READ) as saved:
+                for i in range(cached):
+                    yield saved[i * size:(i + 1) * size]
+        f.seek(cached * size)
+        if workers:
+            missing = parallel_stretched_digests(salt, start=cached, workers=workers)
+        else:
+            missing = stretched_digests(salt, start=cached)
+        for digest in missing:
+            f.write(digest)
+            yield digest
+
+def test_cached_stretched_digests(tmp_path):
+    cached = functools.partial(cached_stretched_digests, cache_dir=tmp_path)
+    first = list(itertools.islice(cached("abc"), 5))
+    assert first == list(itertools.islice(stretched_digests("abc"), 5))
+    assert (tmp_path / "stretched-abc.md5").stat().st_size == 5 * 16
+    # Read the five, and compute three more.
+    more = list(itertools.islice(cached("abc"), 8))
+    assert more[:5] == first
+    assert more[5:] == list(itertools.islice(stretched_digests("abc", start=5), 3))
+    assert (tmp_path / "stretched-abc.md5").stat().st_size == 8 * 16
+    # A partial digest is recomputed.
+    with open(tmp_path / "stretched-abc.md5", "ab") as f:
+        f.write(b"xyz")
+    assert list(itertools.islice(cached("abc"), 9)) == more + [next(stretched_digests("abc", start=8))]
+    assert (tmp_path / "stretched-abc.md5").stat().st_size == 9 * 16
+    # Compute the rest in parallel.
+    more = list(itertools.islice(cached("abc", workers=2), 12))
+    assert more == list(itertools.islice(stretched_digests("abc"), 12))
+
+
 def puzzle2():
-    complete = complete_keys(INPUT, stretched_hashes)
+    digests = functools.partial(cached_stretched_digests, workers=os.cpu_count())
+    complete = complete_keys(INPUT, digests)
     print(f"Puzzle 2: the 64th key is at index {complete[63]}")
 
 
@@ -3,10 +3,11 @@
 # http://adventofcode.com/2016/day/17
 
 import collections
-import hashlib
 
 import pytest
 
+import prefixmd5
+
 State = collections.namedtuple("State", "x, y, path")
 
 DELTAS = {
@@ -21,7 +22,7 @@ def is_open(c):
 
 def next_steps(x, y, passcode, path):
     """Generate next possible steps from here."""
-    h = hashlib.md5((passcode + path).encode("ascii")).hexdigest()
+    h = prefixmd5.hasher(passcode).hexdigest(path)
     if y > 1 and is_open(h[0]):
         yield "U"
     if y < 4 and is_open(h[1]):
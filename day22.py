@@ -71,7 +71,7 @@ for a, b in itertools.product(nodes, repeat=2):
 print(f"Part 1: there are {len(viable)} viable pairs")
 
 
-from astar import State, search
+from astar import LifelongAStar, SearchStats, State, search
 
 
 class MemMoveState(State):
@@ -90,6 +90,10 @@ class MemMoveState(State):
     def __eq__(self, other):
         return self.zero_location == other.zero_location and self.my_location == other.my_location
 
+    def key(self):
+        (zx, zy), (mx, my) = self.zero_location, self.my_location
+        return (zx << 48) | (zy << 32) | (mx << 16) | my
+
     def is_goal(self):
         return self.my_location == (0, 0)
 
@@ -105,8 +109,36 @@ class MemMoveState(State):
             nstate = MemMoveState(self.nodes, pfrom, nmy_location)
             yield nstate, cost + 1
 
+    def previous_states(self, cost):
+        if not self.nodes[self.zero_location].movable:
+            return
+        for pto in adjacent_coords(*self.zero_location, self.nodes.maxx, self.nodes.maxy):
+            if pto == self.my_location:
+                # The data was moved from where the 0 is now.
+                yield MemMoveState(self.nodes, pto, self.zero_location), cost + 1
+            else:
+                yield MemMoveState(self.nodes, pto, self.my_location), cost + 1
+
     def guess_completion_cost(self):
-        return dist((0, 0), self.my_location) + dist(self.zero_location, self.my_location)
+        if self.my_location == (0, 0):
+            return 0
+        # The 0 has to get next to my data, and then my data has to move to
+        # (0, 0).
+        return dist((0, 0), self.my_location) + dist(self.zero_location, self.my_location) - 1
+
+    def guess_cost_from(self, start):
+        # Every move moves the 0 one step.
+        guess = dist(start.zero_location, self.zero_location)
+        if self.my_location != start.my_location:
+            # The 0 had to get next to my data, then my data moved here, then
+            # the 0 moved away from next to it.
+            guess = max(
+                guess,
+                dist(start.zero_location, start.my_location) - 1
+                + dist(start.my_location, self.my_location)
+                + dist(self.my_location, self.zero_location) - 1
+            )
+        return guess
 
     def summary(self):
         return f"0 at {self.zero_location}, me at {self.my_location}, guess {self.guess_completion_cost()}"
@@ -122,12 +154,29 @@ def test_dist(pt1, pt2, answer):
     assert dist(pt1, pt2) == answer
 
 
-def steps_to_move_data(nodes):
-    return search(MemMoveState(nodes))
+def goal_states(nodes):
+    """All the states with my data at (0, 0)."""
+    for node in nodes:
+        if node.movable and (node.x, node.y) != (0, 0):
+            yield MemMoveState(nodes, (node.x, node.y), (0, 0))
 
-def test_steps_to_move_data():
-    nodes = Nodes()
-    nodes.read("""\
+def states_with_zero_at(nodes, location):
+    """All the states with the empty node at `location`.
+
+    These are the states whose incoming moves change if the node at `location`
+    changes whether it's movable.
+
+    """
+    for node in nodes:
+        if (node.x, node.y) != location:
+            yield MemMoveState(nodes, location, (node.x, node.y))
+
+def steps_to_move_data(nodes, bidirectional=False):
+    if bidirectional:
+        return search(MemMoveState(nodes), bidirectional=True, goal_states=goal_states(nodes))
+    return search(MemMoveState(nodes), integral=True)
+
+SAMPLE_NODES = """\
 Filesystem            Size  Used  Avail  Use%
 /dev/grid/node-x0-y0   10T    8T     2T   80%
 /dev/grid/node-x0-y1   11T    6T     5T   54%
@@ -138,8 +187,62 @@ Filesystem            Size  Used  Avail  Use%
 /dev/grid/node-x2-y0   10T    6T     4T   60%
 /dev/grid/node-x2-y1    9T    8T     1T   88%
 /dev/grid/node-x2-y2    9T    6T     3T   66%
-""".splitlines())
-    assert steps_to_move_data(nodes) == 7
+"""
+
+@pytest.mark.parametrize("bidirectional", [False, True])
+def test_steps_to_move_data(bidirectional):
+    nodes = Nodes()
+    nodes.read(SAMPLE_NODES.splitlines())
+    assert steps_to_move_data(nodes, bidirectional) == 7
+
+def test_guess_is_consistent():
+    # Bidirectional search needs consistent guesses to stop at the right time.
+    nodes = Nodes()
+    nodes.read(SAMPLE_NODES.splitlines())
+    start = MemMoveState(nodes)
+    assert start.guess_cost_from(start) == 0
+    to_check = [start]
+    seen = set(to_check)
+    while to_check:
+        state = to_check.pop()
+        guess = state.guess_completion_cost()
+        guess_from = state.guess_cost_from(start)
+        if state.is_goal():
+            assert guess == 0
+        for nstate, cost in state.next_states(0):
+            assert guess <= cost + nstate.guess_completion_cost()
+            assert nstate.guess_cost_from(start) <= guess_from + cost
+            if nstate not in seen:
+                seen.add(nstate)
+                to_check.append(nstate)
+
+def test_lifelong_astar():
+    nodes = Nodes()
+    nodes.read(SAMPLE_NODES.splitlines())
+    lpa = LifelongAStar(MemMoveState(nodes))
+    assert lpa.search() == 7
+
+    # Block the middle node: now the empty space has to go around it.
+    nodes[1, 1].movable = False
+    lpa.changed(states_with_zero_at(nodes, (1, 1)))
+    assert lpa.search() == search(MemMoveState(nodes)) == 9
+
+    nodes[1, 1].movable = True
+    lpa.changed(states_with_zero_at(nodes, (1, 1)))
+    assert lpa.search() == 7
+
+def test_search_stats():
+    nodes = Nodes()
+    nodes.read(SAMPLE_NODES.splitlines())
+    records = []
+    assert search(MemMoveState(nodes), stats=SearchStats(records.append)) == 7
+    # Only the final report: the search is too quick for any others.
+    assert len(records) == 1
+    record = records[0]
+    assert record["cost"] == 7
+    assert record["expansions"] == record["visited"]
+    assert record["generations"] >= record["expansions"]
+    assert record["live"] <= record["heap_size"]
 
 
 if __name__ == '__main__':
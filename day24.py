@@ -2,15 +2,23 @@
 http://adventofcode.com/2016/day/24
 """
 
+import asyncio
 import collections
+import functools
 import itertools
 import string
 import textwrap
+import time
 
 from colorama import Fore, Back, Style
 import pytest
 
-from astar import State, search
+from astar import (
+    AStar, BidirectionalAStar, PatternDatabase, SearchCancelled, SearchStepper, State, anytime_search, search,
+    search_async,
+)
+import extsearch
+from priqueue import IndexedPriorityQueue
 
 
 class Ducts:
@@ -19,6 +27,10 @@ class Ducts:
         self.goals = set()
         self.start = None
         self.original = set()
+        # A bit for each goal, for DuctExplorerState.key().
+        self.goal_bits = {}
+        # DuctPatternDatabases to guess completion costs with.
+        self.pattern_dbs = []
 
     @classmethod
     def read(cls, lines, goals='123456789'):
@@ -33,6 +45,7 @@ class Ducts:
                 elif char in goals:
                     self.locations.add((col, row))
                     self.goals.add((col, row))
+        self.goal_bits = {goal: 1 << i for i, goal in enumerate(sorted(self.goals))}
         return self
 
     def show(self):
@@ -81,9 +94,19 @@ class Ducts:
         trimmed.original = self.locations
         trimmed.locations = locs
         trimmed.goals = self.goals
+        trimmed.goal_bits = self.goal_bits
         trimmed.start = self.start
         return trimmed
 
+    def with_goals(self, goals):
+        """Produce a new Ducts with the same locations, but only `goals`."""
+        new = self.__class__()
+        new.locations = self.locations
+        new.start = self.start
+        new.goals = set(goals)
+        new.goal_bits = {goal: 1 << i for i, goal in enumerate(sorted(new.goals))}
+        return new
+
 
 def neighbors(x, y):
     """Produce coordinates of orthogonal neighbors."""
@@ -126,6 +149,23 @@ class DuctExplorerState(State):
             self.goals_to_go == other.goals_to_go
         )
 
+    def key(self):
+        goals = 0
+        for goal in self.goals_to_go:
+            goals |= self.ducts.goal_bits[goal]
+        x, y = self.pos
+        return (goals << 32) | (x << 16) | y
+
+    def encode(self):
+        return self.key().to_bytes(8, "big")
+
+    @classmethod
+    def decode(cls, ducts, data):
+        key = int.from_bytes(data, "big")
+        pos = ((key >> 16) & 0xFFFF, key & 0xFFFF)
+        goals = {goal for goal, bit in ducts.goal_bits.items() if key >> 32 & bit}
+        return cls(ducts, pos, goals)
+
     def is_goal(self):
         # This is a goal state if we have no more goal positions to visit.
         return not self.goals_to_go
@@ -140,8 +180,61 @@ class DuctExplorerState(State):
             nstate = self.__class__(self.ducts, nxy, goals)
             yield nstate, cost + 1
 
+    def previous_states(self, cost):
+        if self.pos not in self.ducts.locations:
+            return
+        goal_sets = [self.goals_to_go]
+        if self.pos in self.ducts.goals and self.pos not in self.goals_to_go:
+            # We might have just reached this goal.
+            goal_sets.append(self.goals_to_go | {self.pos})
+        for nxy in neighbors(*self.pos):
+            if nxy not in self.ducts.locations:
+                continue
+            for goals in goal_sets:
+                if nxy in goals:
+                    continue
+                yield self.__class__(self.ducts, nxy, goals), cost + 1
+
     def guess_completion_cost(self):
-        return len(self.goals_to_go)
+        guess = len(self.goals_to_go)
+        for pattern_db in self.ducts.pattern_dbs:
+            guess = max(guess, pattern_db.guess(self))
+        return guess
+
+    def guess_cost_from(self, start):
+        # The path from `start` got here by way of each goal it has visited.
+        sx, sy = start.pos
+        x, y = self.pos
+        guess = abs(sx - x) + abs(sy - y)
+        for gx, gy in start.goals_to_go - self.goals_to_go:
+            guess = max(guess, abs(sx - gx) + abs(sy - gy) + abs(gx - x) + abs(gy - y))
+        return guess
+
+
+class DuctPatternDatabase:
+    """Exact costs to visit some of the goals, from anywhere.
+
+    The abstraction of a DuctExplorerState ignores the goals not in `pattern`.
+
+    """
+    def __init__(self, ducts, pattern, db=None):
+        self.abstract = ducts.with_goals(pattern)
+        self.location_ids = {loc: i for i, loc in enumerate(sorted(ducts.locations))}
+        self.pattern_size = len(self.abstract.goals)
+        if db is None:
+            goal_states = [DuctExplorerState(self.abstract, loc, set()) for loc in ducts.locations]
+            size = len(self.location_ids) << self.pattern_size
+            db = PatternDatabase.build(goal_states, self.rank, size)
+        self.db = db
+
+    def rank(self, state):
+        goals = 0
+        for goal in state.goals_to_go:
+            goals |= self.abstract.goal_bits.get(goal, 0)
+        return (self.location_ids[state.pos] << self.pattern_size) | goals
+
+    def guess(self, state):
+        return self.db[self.rank(state)]
 
 
 class DuctExplorerLoopState(DuctExplorerState):
@@ -150,14 +243,27 @@ class DuctExplorerLoopState(DuctExplorerState):
         return self.pos == self.ducts.start and super().is_goal()
 
 
+# The sample from the puzzle.
+SAMPLE_MAP = """\
+###########
+#0.1.....2#
+#.#######.#
+#4.......3#
+###########
+"""
+
+MAZE_MAP = """\
+#######
+#0....#
+#.#.#.#
+#.#...#
+#.#4###
+#123###
+#######
+"""
+
 @pytest.mark.parametrize("cost, map", [
-    (14, """\
-        ###########
-        #0.1.....2#
-        #.#######.#
-        #4.......3#
-        ###########
-        """),
+    (14, SAMPLE_MAP),
     (3, """\
         #####
         #0..#
@@ -176,28 +282,219 @@ class DuctExplorerLoopState(DuctExplorerState):
         #1..#
         #####
         """),
-    (7, """\
-        #######
-        #0....#
-        #.#.#.#
-        #.#...#
-        #.#4###
-        #123###
-        #######
-        """),
+    (7, MAZE_MAP),
 ])
 def test_astar(cost, map):
     test_ducts = Ducts.read(textwrap.dedent(map).splitlines())
     actual_cost = search(DuctExplorerState(test_ducts))
     assert cost == actual_cost
 
+    actual_cost = search(DuctExplorerState(test_ducts), queue_class=IndexedPriorityQueue)
+    assert cost == actual_cost
+
+    actual_cost = search(DuctExplorerState(test_ducts), integral=True)
+    assert cost == actual_cost
+
+    goal_states = [DuctExplorerState(test_ducts, pos, set()) for pos in test_ducts.locations]
+    actual_cost = search(DuctExplorerState(test_ducts), bidirectional=True, goal_states=goal_states)
+    assert cost == actual_cost
+
+def test_bidirectional_expansions():
+    # Guessing the cost back to the start makes the backward search
+    # cheaper than plain A*, not just Dijkstra's from every goal.
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    start = DuctExplorerState(test_ducts)
+    astar = AStar()
+    assert astar.search(start) == 14
+    goal_states = [DuctExplorerState(test_ducts, pos, set()) for pos in test_ducts.locations]
+    bidirectional = BidirectionalAStar()
+    assert bidirectional.search(start, goal_states) == 14
+    expanded = len(bidirectional.forward_visited) + len(bidirectional.backward_visited)
+    assert expanded < astar.num_visited
+
+def test_guess_cost_from_is_consistent():
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    start = DuctExplorerState(test_ducts)
+    assert start.guess_cost_from(start) == 0
+    to_check = [start]
+    seen = set(to_check)
+    while to_check:
+        state = to_check.pop()
+        guess = state.guess_cost_from(start)
+        for nstate, cost in state.next_states(0):
+            assert nstate.guess_cost_from(start) <= guess + cost
+            if nstate not in seen:
+                seen.add(nstate)
+                to_check.append(nstate)
+
+@pytest.mark.parametrize("map_text, cost", [(SAMPLE_MAP, 14), (MAZE_MAP, 7)])
+def test_parallel_astar(map_text, cost):
+    test_ducts = Ducts.read(map_text.splitlines())
+    assert search(DuctExplorerState(test_ducts), workers=3) == cost
+
+def test_anytime_search():
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    # With no budget, we get the optimal answer.
+    assert anytime_search(DuctExplorerState(test_ducts)) == (14, 1)
+
+    # With a small budget, we get some answer, and an honest bound.
+    cost, bound = anytime_search(DuctExplorerState(test_ducts), weight=5, max_expansions=40)
+    assert cost >= 14
+    assert 1 < bound
+    assert cost <= bound * 14
+
+    with pytest.raises(Exception, match="No solution within budget"):
+        anytime_search(DuctExplorerState(test_ducts), weight=5, max_expansions=10)
+
+@pytest.mark.parametrize("max_visited", [None, 0])
+def test_path(max_visited):
+    test_ducts = Ducts.read(MAZE_MAP.splitlines())
+    start = DuctExplorerState(test_ducts)
+    cost, path = search(start, max_visited=max_visited, path=True)
+    assert cost == 7
+    assert len(path) == cost + 1
+    assert path[0] == start
+    assert path[-1].is_goal()
+    for here, there in zip(path, path[1:]):
+        assert there in [s for s, _ in here.next_states(0)]
+
+@pytest.mark.parametrize("use_guess", [False, True])
+def test_external_search(tmp_path, use_guess):
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    cost = extsearch.search(
+        DuctExplorerState(test_ducts),
+        DuctExplorerState.encode,
+        functools.partial(DuctExplorerState.decode, test_ducts),
+        use_guess=use_guess,
+        workdir=tmp_path,
+        run_size=10,
+    )
+    assert cost == 14
+
+def test_pattern_database(tmp_path):
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    start = DuctExplorerState(test_ducts)
+    goals = sorted(test_ducts.goals)
+
+    # A pattern of all the goals is exact.
+    pattern_db = DuctPatternDatabase(test_ducts, goals)
+    assert pattern_db.guess(start) == 14
+
+    pattern_db.db.save(tmp_path / "pdb")
+    loaded = DuctPatternDatabase(test_ducts, goals, PatternDatabase.load(tmp_path / "pdb"))
+    assert loaded.db.costs == pattern_db.db.costs
+
+    # Two halves of the goals are lower bounds.
+    test_ducts.pattern_dbs = [
+        DuctPatternDatabase(test_ducts, goals[:2]),
+        DuctPatternDatabase(test_ducts, goals[2:]),
+    ]
+    assert 4 < start.guess_completion_cost() <= 14
+    assert search(start) == 14
+
+def test_pattern_database_unsolvable():
+    # Goal 1 can't be reached, so the pattern database's guess is infinite.
+    test_ducts = Ducts.read(textwrap.dedent("""\
+        #######
+        #0.#1.#
+        #######
+        """).splitlines())
+    test_ducts.pattern_dbs = [DuctPatternDatabase(test_ducts, sorted(test_ducts.goals))]
+    start = DuctExplorerState(test_ducts)
+    assert start.guess_completion_cost() == float('inf')
+    with pytest.raises(Exception, match="No solution"):
+        search(start, integral=True)
+
+def test_search_stepper():
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    stepper = SearchStepper(DuctExplorerState(test_ducts), expansions=5)
+    steps = 1
+    while not stepper.step():
+        steps += 1
+    assert steps > 1
+    assert stepper.result == 14
+
+    stepper = SearchStepper(DuctExplorerState(test_ducts), expansions=5)
+    stepper.step()
+    stepper.cancel()
+    with pytest.raises(SearchCancelled):
+        stepper.step()
+
+    stepper = SearchStepper(DuctExplorerState(test_ducts), expansions=5, seconds=0)
+    with pytest.raises(TimeoutError):
+        stepper.step()
+
+    assert asyncio.run(search_async(DuctExplorerState(test_ducts), expansions=5)) == 14
+
+def test_search_stepper_ida_star():
+    # After switching to IDA*, the search still runs a slice at a time.
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    stepper = SearchStepper(DuctExplorerState(test_ducts), expansions=1, max_visited=5)
+    steps = 1
+    while not stepper.step():
+        steps += 1
+    assert steps > 10
+    assert stepper.result == 14
+
+    stepper = SearchStepper(DuctExplorerState(test_ducts), expansions=1, seconds=0.1, max_visited=5)
+    for _ in range(10):
+        stepper.step()
+    time.sleep(0.1)
+    with pytest.raises(TimeoutError):
+        stepper.step()
+
+def test_checkpoint(tmp_path):
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    astar = AStar(checkpoint=tmp_path, checkpoint_seconds=0)
+    astar.CHECKPOINT_EVERY = 10
+    # Stop the search part way through.
+    steps = astar.run(DuctExplorerState(test_ducts), slice_size=25)
+    next(steps)
+    steps.close()
+    assert (tmp_path / "open").exists()
+
+    # A new search picks up from the last checkpoint.
+    resumed = AStar(checkpoint=tmp_path)
+    cost, path = resumed.search(DuctExplorerState(test_ducts), path=True)
+    assert cost == 14
+    assert path[0] == DuctExplorerState(test_ducts)
+    assert len(path) == 15
+    assert resumed.num_visited >= 20
+
+    # Finishing removes the checkpoint, so another search can use the directory.
+    assert list(tmp_path.iterdir()) == []
+    other_ducts = Ducts.read(MAZE_MAP.splitlines())
+    assert AStar(checkpoint=tmp_path).search(DuctExplorerState(other_ducts)) == 7
+
+def test_checkpoint_for_another_search(tmp_path):
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    steps = AStar(checkpoint=tmp_path, checkpoint_seconds=0).run(DuctExplorerState(test_ducts), slice_size=25)
+    next(steps)
+    steps.close()
+    other_ducts = Ducts.read(MAZE_MAP.splitlines())
+    with pytest.raises(ValueError):
+        AStar(checkpoint=tmp_path).search(DuctExplorerState(other_ducts))
+    # The checkpoint is still there for the search it belongs to.
+    assert AStar(checkpoint=tmp_path).search(DuctExplorerState(test_ducts)) == 14
+
+@pytest.mark.parametrize("max_visited", [0, 5])
+def test_ida_star(max_visited):
+    test_ducts = Ducts.read(SAMPLE_MAP.splitlines())
+    assert search(DuctExplorerState(test_ducts), max_visited=max_visited) == 14
+
 
 if __name__ == '__main__':
     with open('day24_input.txt') as finput:
         ducts = Ducts.read(finput)
     ducts = ducts.trim()
-    cost = search(DuctExplorerState(ducts))
+    goals = sorted(ducts.goals)
+    half = len(goals) // 2
+    ducts.pattern_dbs = [
+        DuctPatternDatabase(ducts, goals[:half]),
+        DuctPatternDatabase(ducts, goals[half:]),
+    ]
+    cost = search(DuctExplorerState(ducts), integral=True)
     print(f"Part 1: fewest steps is {cost}")
 
-    cost = search(DuctExplorerLoopState(ducts))
+    cost = search(DuctExplorerLoopState(ducts), integral=True)
     print(f"Part 2: fewest steps is {cost}")
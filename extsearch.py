@@ -0,0 +1,173 @@
+"""Breadth-first search with the frontier and visited states on disk.
+
+Each layer of the search (the states first reached in the same number of
+moves) is a file of sorted, encoded states.  The successors of a layer are
+generated into sorted run files of at most `run_size` states, which are then
+merged, with duplicates and states from earlier layers dropped as they go by:
+delayed duplicate detection.  Only one run of states is in memory at a time.
+
+With a guess at the remaining cost, the search is breadth-first iterative
+deepening A* (BFIDA*): each pass prunes states whose moves so far plus guess
+exceed a bound, and the bound grows to the smallest pruned total until a goal
+is found.
+
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+
+def write_records(path, records):
+    """Write byte strings to a file, each prefixed with its length."""
+    count = 0
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(len(record).to_bytes(2, "little"))
+            f.write(record)
+            count += 1
+    return count
+
+
+def read_records(path):
+    """Produce the byte strings written by `write_records`."""
+    with open(path, "rb") as f:
+        while True:
+            length = f.read(2)
+            if not length:
+                return
+            yield f.read(int.from_bytes(length, "little"))
+
+
+def unique(records):
+    """Produce sorted `records` without duplicates."""
+    for record, _ in itertools.groupby(records):
+        yield record
+
+
+def difference(records, others):
+    """Produce the sorted `records` that aren't in the sorted `others`."""
+    others = iter(others)
+    other = next(others, None)
+    for record in records:
+        while other is not None and other < record:
+            other = next(others, None)
+        if other != record:
+            yield record
+
+
+class LayeredSearch:
+    """A breadth-first search keeping its layers in files.
+
+    `encode` turns a state into a byte string, and `decode` turns it back.
+    Equal states must encode to equal byte strings.
+
+    `keep_layers` is how many earlier layers to check for duplicates.  None
+    keeps them all, which is always right.  For a search where every move can
+    be undone, 2 is enough.
+
+    """
+    def __init__(self, encode, decode, workdir=None, run_size=1000000, keep_layers=None):
+        self.encode = encode
+        self.decode = decode
+        self.workdir = workdir
+        self.run_size = run_size
+        self.keep_layers = keep_layers
+        self.expansions = 0
+
+    def search(self, start, neighbors, is_goal, guess=None, log=False):
+        """Search from `start`, returning the number of moves to a goal.
+
+        `neighbors(state)` produces the states one move away, and
+        `is_goal(state)` says if we're done.  `guess(state)`, if provided,
+        must not overestimate the moves remaining.
+
+        """
+        if is_goal(start):
+            return 0
+        workdir = tempfile.mkdtemp(dir=self.workdir, prefix="layers-")
+        try:
+            bound = guess(start) if guess else float('inf')
+            while True:
+                moves, bound = self.bounded_search(workdir, start, neighbors, is_goal, guess, bound, log)
+                if moves is not None:
+                    return moves
+                if bound == float('inf'):
+                    raise Exception("No solution")
+                if log:
+                    print(f"No solution, increasing bound to {bound}")
+        finally:
+            shutil.rmtree(workdir)
+
+    def bounded_search(self, workdir, start, neighbors, is_goal, guess, bound, log):
+        """One breadth-first pass, pruning states whose total exceeds `bound`.
+
+        Returns (moves, next_bound): the moves to a goal if one was found, and
+        the smallest total that was pruned.
+
+        """
+        next_bound = float('inf')
+        layers = [os.path.join(workdir, "layer-0")]
+        write_records(layers[0], [self.encode(start)])
+        for depth in itertools.count(start=1):
+            runs = []
+            run = set()
+            for record in read_records(layers[-1]):
+                self.expansions += 1
+                for nstate in neighbors(self.decode(record)):
+                    if guess:
+                        total = depth + guess(nstate)
+                        if total > bound:
+                            next_bound = min(next_bound, total)
+                            continue
+                    if is_goal(nstate):
+                        return depth, next_bound
+                    run.add(self.encode(nstate))
+                    if len(run) >= self.run_size:
+                        runs.append(self.write_run(workdir, depth, len(runs), run))
+                        run = set()
+            if run:
+                runs.append(self.write_run(workdir, depth, len(runs), run))
+
+            earlier = layers if self.keep_layers is None else layers[-self.keep_layers:]
+            new_states = difference(
+                unique(heapq.merge(*(read_records(path) for path in runs))),
+                heapq.merge(*(read_records(path) for path in earlier)),
+            )
+            layer = os.path.join(workdir, f"layer-{depth}")
+            count = write_records(layer, new_states)
+            for path in runs:
+                os.remove(path)
+            if self.keep_layers is not None:
+                while len(layers) >= self.keep_layers:
+                    os.remove(layers.pop(0))
+            layers.append(layer)
+            if log:
+                print(f"Layer {depth}: {count} states")
+            if count == 0:
+                return None, next_bound
+
+    def write_run(self, workdir, depth, number, records):
+        path = os.path.join(workdir, f"run-{depth}-{number}")
+        write_records(path, sorted(records))
+        return path
+
+
+def search(start_state, encode, decode, log=False, use_guess=True, **kwargs):
+    """Search from an astar.State, keeping the search on disk.
+
+    Every move must cost 1.  Returns the cost to reach the goal.  Other
+    keyword arguments are passed to LayeredSearch.
+
+    """
+    def neighbors(state):
+        for nstate, cost in state.next_states(0):
+            if cost != 1:
+                raise ValueError(f"Layered search needs moves that cost 1, not {cost}")
+            yield nstate
+
+    guess = (lambda state: state.guess_completion_cost()) if use_guess else None
+    searcher = LayeredSearch(encode, decode, **kwargs)
+    return searcher.search(start_state, neighbors, lambda state: state.is_goal(), guess, log)
@@ -0,0 +1,134 @@
+"""MD5 hashes of a fixed prefix followed by varying suffixes.
+
+Day 5 hashes a door id, day 14 a salt, and day 17 a passcode, each followed
+by something different every time.  Integer suffixes are formatted with
+bytes formatting, rather than making a str and encoding it.  A prefix at
+least as long as an md5 block is hashed just once, into an md5 object that
+is copied for each suffix.  Shorter prefixes are cheaper to hash again than
+to copy.
+
+"""
+
+import functools
+import hashlib
+
+import pytest
+
+DIGEST_SIZE = 16
+
+
+class PrefixMD5:
+    """MD5 hashes of `prefix`, a str or bytes, followed by suffixes."""
+    def __init__(self, prefix):
+        if isinstance(prefix, str):
+            prefix = prefix.encode("ascii")
+        self.prefix = prefix
+        self.md5 = hashlib.md5(prefix)
+        self.primed = len(prefix) >= self.md5.block_size
+        self.int_format = prefix.replace(b"%", b"%%") + b"%d"
+
+    def __repr__(self):
+        return f"<PrefixMD5 {self.prefix!r}>"
+
+    def hash(self, suffix):
+        """An md5 object for the prefix followed by `suffix`, a str or bytes."""
+        if isinstance(suffix, str):
+            suffix = suffix.encode("ascii")
+        if self.primed:
+            h = self.md5.copy()
+            h.update(suffix)
+            return h
+        return hashlib.md5(self.prefix + suffix)
+
+    def digest(self, suffix):
+        return self.hash(suffix).digest()
+
+    def hexdigest(self, suffix):
+        return self.hash(suffix).hexdigest()
+
+    def hash_int(self, i):
+        """An md5 object for the prefix followed by the decimal digits of `i`."""
+        if self.primed:
+            h = self.md5.copy()
+            h.update(b"%d" % i)
+            return h
+        return hashlib.md5(self.int_format % i)
+
+    def digest_int(self, i):
+        return self.hash_int(i).digest()
+
+    def hexdigest_int(self, i):
+        return self.hash_int(i).hexdigest()
+
+    def hash_range(self, start, count, buffer=None):
+        """The digests for integer suffixes from `start`, `count` of them.
+
+        The digests are written into `buffer` if provided, or a new
+        bytearray, which is returned.  The digest for start+n is at offset
+        DIGEST_SIZE*n.
+
+        """
+        if buffer is None:
+            buffer = bytearray(DIGEST_SIZE * count)
+        with memoryview(buffer) as view:
+            offset = 0
+            if self.primed:
+                copy = self.md5.copy
+                for i in range(start, start + count):
+                    h = copy()
+                    h.update(b"%d" % i)
+                    view[offset:offset + DIGEST_SIZE] = h.digest()
+                    offset += DIGEST_SIZE
+            else:
+                md5 = hashlib.md5
+                int_format = self.int_format
+                for i in range(start, start + count):
+                    view[offset:offset + DIGEST_SIZE] = md5(int_format % i).digest()
+                    offset += DIGEST_SIZE
+        return buffer
+
+
+@functools.lru_cache(maxsize=32)
+def hasher(prefix):
+    """A shared PrefixMD5 for `prefix`."""
+    return PrefixMD5(prefix)
+
+
+def hash_range(prefix, start, count, buffer=None):
+    """The digests of `prefix` followed by start, start+1, ...: see PrefixMD5.hash_range."""
+    return hasher(prefix).hash_range(start, count, buffer)
+
+
+def expected_digests(prefix, start, count):
+    return b"".join(
+        hashlib.md5(f"{prefix}{i}".encode("ascii")).digest()
+        for i in range(start, start + count)
+    )
+
+@pytest.mark.parametrize("prefix", [
+    "abc",
+    "100%d%s",                  # Not a format string.
+    "passcode" * 8,             # A full md5 block: the primed copy.
+    "%%" + "x" * 70,
+])
+def test_prefix_md5(prefix):
+    md5 = PrefixMD5(prefix)
+    assert md5.primed == (len(prefix) >= 64)
+    for i in [0, 7, 3231929]:
+        expected = hashlib.md5(f"{prefix}{i}".encode("ascii"))
+        assert md5.digest_int(i) == expected.digest()
+        assert md5.hexdigest_int(i) == expected.hexdigest()
+        assert md5.hexdigest(str(i)) == expected.hexdigest()
+        assert md5.digest(str(i).encode("ascii")) == expected.digest()
+    assert md5.hash_range(95, 10) == expected_digests(prefix, 95, 10)
+    assert hash_range(prefix.encode("ascii"), 95, 10) == expected_digests(prefix, 95, 10)
+
+@pytest.mark.parametrize("prefix", ["abc%d", "passcode" * 8])
+def test_hash_range_into_buffer(prefix):
+    buffer = bytearray(b"-" * (DIGEST_SIZE * 5 + 3))
+    view = memoryview(buffer)[2:]
+    assert hash_range(prefix, 998, 5, view) is view
+    view.release()
+    assert buffer[:2] == b"--"
+    assert buffer[2:-1] == expected_digests(prefix, 998, 5)
+    assert buffer[-1:] == b"-"
@@ -3,6 +3,8 @@
 import heapq
 import itertools
 
+import pytest
+
 
 class PriorityQueue:
     """A priority queue, with fast containment."""
@@ -12,14 +14,22 @@ class PriorityQueue:
 
     REMOVED = object()
 
+    # Rebuild the heap when removed entries outnumber live ones, and there are
+    # at least this many of them.
+    MIN_COMPACT = 1000
+
     def __init__(self):
         self.q = []
         self.counter = itertools.count()
         self.items = {}
+        self.removed = 0
 
     def __len__(self):
         return len(self.items)
 
+    def __iter__(self):
+        return iter(self.items)
+
     def __contains__(self, item):
         return item in self.items
 
@@ -33,6 +43,15 @@ class PriorityQueue:
     def remove(self, item):
         entry = self.items.pop(item)
         entry[2] = self.REMOVED
+        self.removed += 1
+        if self.removed > len(self.items) and self.removed >= self.MIN_COMPACT:
+            self.compact()
+
+    def compact(self):
+        """Rebuild the heap without the removed entries."""
+        self.q = [entry for entry in self.q if entry[2] is not self.REMOVED]
+        heapq.heapify(self.q)
+        self.removed = 0
 
     def pop(self):
         while self.q:
@@ -40,7 +59,258 @@ class PriorityQueue:
             if item is not self.REMOVED:
                 del self.items[item]
                 return item
+            self.removed -= 1
         raise IndexError("Pop from empty priority queue")
 
+    def min_priority(self):
+        """The priority of the item pop() would return next."""
+        while self.q and self.q[0][2] is self.REMOVED:
+            heapq.heappop(self.q)
+            self.removed -= 1
+        if not self.q:
+            raise IndexError("Empty priority queue has no minimum")
+        return self.q[0][0]
+
+    def empty(self):
+        return not self.items
+
+
+class IndexedPriorityQueue:
+    """A priority queue that changes priorities in place.
+
+    A binary heap that knows where each item is, so re-adding an item moves
+    its entry rather than leaving a removed entry behind.
+
+    """
+
+    def __init__(self):
+        self.q = []
+        self.counter = itertools.count()
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.q)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def add(self, item, priority):
+        entry = [priority, next(self.counter), item]
+        pos = self.positions.get(item)
+        if pos is None:
+            self.q.append(entry)
+            self.positions[item] = len(self.q) - 1
+            self._sift_up(len(self.q) - 1)
+        else:
+            old = self.q[pos]
+            self.q[pos] = entry
+            if entry < old:
+                self._sift_up(pos)
+            else:
+                self._sift_down(pos)
+
+    def remove(self, item):
+        self._take(self.positions[item])
+
+    def pop(self):
+        if not self.q:
+            raise IndexError("Pop from empty priority queue")
+        return self._take(0)
+
+    def min_priority(self):
+        """The priority of the item pop() would return next."""
+        if not self.q:
+            raise IndexError("Empty priority queue has no minimum")
+        return self.q[0][0]
+
+    def empty(self):
+        return not self.q
+
+    def _take(self, pos):
+        """Remove the entry at `pos`, and return its item."""
+        q = self.q
+        item = q[pos][2]
+        del self.positions[item]
+        last = q.pop()
+        if pos < len(q):
+            q[pos] = last
+            self.positions[last[2]] = pos
+            self._sift_up(pos)
+            self._sift_down(self.positions[last[2]])
+        return item
+
+    def _sift_up(self, pos):
+        q, positions = self.q, self.positions
+        entry = q[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if q[parent] <= entry:
+                break
+            q[pos] = q[parent]
+            positions[q[pos][2]] = pos
+            pos = parent
+        q[pos] = entry
+        positions[entry[2]] = pos
+
+    def _sift_down(self, pos):
+        q, positions = self.q, self.positions
+        n = len(q)
+        entry = q[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= n:
+                break
+            if child + 1 < n and q[child + 1] < q[child]:
+                child += 1
+            if entry <= q[child]:
+                break
+            q[pos] = q[child]
+            positions[q[pos][2]] = pos
+            pos = child
+        q[pos] = entry
+        positions[entry[2]] = pos
+
+
+class BucketQueue:
+    """A priority queue for small non-negative integer priorities.
+
+    Items are kept in a list of buckets, one per priority, so adding and
+    popping are O(1) amortized when priorities popped never decrease by much,
+    as in A* with integer costs.
+
+    """
+
+    def __init__(self):
+        # Each bucket is a dict used as an insertion-ordered set, so items of
+        # equal priority come out first-in first-out.
+        self.buckets = []
+        self.items = {}
+        self.lowest = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def add(self, item, priority):
+        if not isinstance(priority, int) or priority < 0:
+            raise ValueError(f"BucketQueue priorities must be non-negative integers, not {priority!r}")
+        if item in self:
+            self.remove(item)
+        while priority >= len(self.buckets):
+            self.buckets.append({})
+        self.buckets[priority][item] = None
+        self.items[item] = priority
+        if priority < self.lowest:
+            self.lowest = priority
+
+    def remove(self, item):
+        del self.buckets[self.items.pop(item)][item]
+
+    def pop(self):
+        bucket = self._lowest_bucket()
+        item = next(iter(bucket))
+        del bucket[item]
+        del self.items[item]
+        return item
+
+    def min_priority(self):
+        """The priority of the item pop() would return next."""
+        self._lowest_bucket()
+        return self.lowest
+
     def empty(self):
         return not self.items
+
+    def _lowest_bucket(self):
+        if not self.items:
+            raise IndexError("Pop from empty priority queue")
+        while not self.buckets[self.lowest]:
+            self.lowest += 1
+        return self.buckets[self.lowest]
+
+
+def test_priority_queue_compacts():
+    q = PriorityQueue()
+    q.MIN_COMPACT = 3
+    for i in range(10):
+        q.add(i, i)
+    # Re-adding an item leaves its old entry behind.
+    for i in range(5):
+        q.add(i, 20 + i)
+    assert len(q) == 10
+    assert len(q.q) == 15
+    assert q.removed == 5
+    # Removing more makes removed entries outnumber live ones.
+    for i in range(5, 10):
+        q.remove(i)
+        assert len(q.q) == len(q) + q.removed
+    assert len(q) == 5
+    assert len(q.q) < 15
+    assert [q.pop() for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert q.empty()
+
+def test_priority_queue_skips_removed():
+    q = PriorityQueue()
+    for i in range(5):
+        q.add(i, i)
+    q.remove(0)
+    q.add(1, 10)
+    assert q.removed == 2
+    # Both removed entries are at the top of the heap.
+    assert q.min_priority() == 2
+    assert q.removed == 0
+    assert [q.pop() for _ in range(4)] == [2, 3, 4, 1]
+    assert q.removed == 0
+    assert q.q == []
+
+@pytest.mark.parametrize("priority", [-1, 2.5, float('inf')])
+def test_bucket_queue_bad_priority(priority):
+    q = BucketQueue()
+    with pytest.raises(ValueError):
+        q.add("x", priority)
+    assert q.empty()
+
+def check_indexed(q):
+    """Check that `q` is a heap, and knows where its items are."""
+    for pos, entry in enumerate(q.q):
+        assert q.positions[entry[2]] == pos
+        if pos:
+            assert q.q[(pos - 1) >> 1] <= entry
+    assert len(q.positions) == len(q.q)
+
+def test_indexed_priority_queue():
+    q = IndexedPriorityQueue()
+    priorities = {}
+    for i in range(20):
+        priorities[i] = (i * 7) % 20 + 10
+        q.add(i, priorities[i])
+        check_indexed(q)
+    # Decrease some keys, increase others, remove some.
+    for i in range(0, 20, 3):
+        priorities[i] -= 10
+        q.add(i, priorities[i])
+        check_indexed(q)
+    for i in range(1, 20, 4):
+        priorities[i] += 15
+        q.add(i, priorities[i])
+        check_indexed(q)
+    for i in [2, 8, 17]:
+        q.remove(i)
+        del priorities[i]
+        check_indexed(q)
+    assert len(q) == len(priorities)
+    assert q.min_priority() == min(priorities.values())
+    popped = []
+    while not q.empty():
+        popped.append(q.pop())
+        check_indexed(q)
+    assert [priorities[i] for i in popped] == sorted(priorities.values())
+    assert sorted(popped) == sorted(priorities)